@@ -0,0 +1,73 @@
+"""
+Benchmark event-loop lag during concurrent logins.
+
+Runs a burst of password verifications either inline in the coroutines,
+as login did before, or through the bounded password hashing pool, while
+a ticker measures how late the event loop wakes it up.
+
+    python -m benchmarks.bench_password_hashing --logins 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from recommender.password_hashing import password_hasher, pwd_context
+
+TICK_SECONDS = 0.005
+
+
+async def measure_lag(stop: asyncio.Event, lags: List[float]):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(loop.time() - start - TICK_SECONDS)
+
+
+async def inline_login(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+async def pooled_login(password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(password, hashed_password)
+
+
+async def run(name: str, login, logins: int, hashed_password: str):
+    stop = asyncio.Event()
+    lags: List[float] = []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    await asyncio.sleep(TICK_SECONDS * 2)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(login("correct horse", hashed_password) for _ in range(logins))
+    )
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1] if lags_ms else 0
+    print(
+        f"{name:<8} total {elapsed:6.2f}s  "
+        f"loop lag median {statistics.median(lags_ms or [0]):7.1f}ms  "
+        f"p99 {p99:7.1f}ms  max {max(lags_ms or [0]):7.1f}ms"
+    )
+
+
+async def main(logins: int):
+    hashed_password = pwd_context.hash("correct horse")
+    print(f"{logins} concurrent logins")
+    await run("inline", inline_login, logins, hashed_password)
+    await run("pooled", pooled_login, logins, hashed_password)
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins))
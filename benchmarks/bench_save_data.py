@@ -0,0 +1,120 @@
+"""
+Benchmark post ingestion against the database in DATABASE_URL.
+
+Compares adding posts one ORM object at a time with the bulk upsert and
+COPY paths of save_submissions, for new posts and for posts that are
+already stored. Benchmark rows are deleted afterwards.
+
+    python -m benchmarks.bench_save_data --posts 5000
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Dict, List
+
+from sqlalchemy import delete
+
+from recommender.database import async_session, engine, init_db
+from recommender.models import Posts
+from recommender.save_data import save_submissions, submission_created_at
+
+
+def make_submissions(count: int, prefix: str) -> List[Dict]:
+    return [
+        {
+            "id": f"{prefix}-{i}",
+            "title": f"Benchmark post {i}",
+            "body": "Battery life is great, the camera could be better. " * 8,
+            "score": i % 500,
+            "created": 1_700_000_000 + i,
+            "comments": [
+                {"id": f"{prefix}-{i}-{j}", "body": "Agreed.", "score": j}
+                for j in range(5)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+async def add_one_by_one(search_query: str, submissions: List[Dict]):
+    """The previous ingestion path, one ORM object per post"""
+    async with async_session() as db:
+        for submission in submissions:
+            db.add(
+                Posts(
+                    id=submission["id"],
+                    source="reddit",
+                    search_query=search_query,
+                    created_at=submission_created_at(submission, "reddit"),
+                    raw_data=submission,
+                )
+            )
+        await db.commit()
+    return {"inserted": len(submissions)}
+
+
+async def upsert(search_query: str, submissions: List[Dict], use_copy: bool):
+    async with async_session() as db:
+        counts = await save_submissions(
+            db, search_query, submissions, "reddit", use_copy=use_copy
+        )
+        await db.commit()
+    return counts
+
+
+async def timed(name: str, run) -> None:
+    start = time.perf_counter()
+    try:
+        counts = await run
+        outcome = counts
+    except Exception as e:
+        outcome = f"failed: {type(e).__name__}"
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {elapsed:>8.3f}s  {outcome}")
+
+
+async def main(posts: int):
+    await init_db()
+    search_query = f"benchmark {uuid.uuid4().hex[:8]}"
+    print(f"{posts} posts, query '{search_query}'")
+
+    try:
+        batches = {
+            name: make_submissions(posts, f"bench-{name}-{uuid.uuid4().hex}")
+            for name in ["orm", "upsert", "copy"]
+        }
+        await timed(
+            "one by one (new)", add_one_by_one(search_query, batches["orm"])
+        )
+        await timed(
+            "one by one (already stored)",
+            add_one_by_one(search_query, batches["orm"]),
+        )
+        await timed(
+            "upsert (new)", upsert(search_query, batches["upsert"], False)
+        )
+        await timed(
+            "upsert (already stored)",
+            upsert(search_query, batches["upsert"], False),
+        )
+        await timed("copy (new)", upsert(search_query, batches["copy"], True))
+        await timed(
+            "copy (already stored)",
+            upsert(search_query, batches["copy"], True),
+        )
+    finally:
+        async with async_session() as db:
+            await db.execute(
+                delete(Posts).filter(Posts.search_query == search_query)
+            )
+            await db.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--posts", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.posts))
@@ -9,9 +9,14 @@ from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from langchain_core.tools import StructuredTool
 from langchain_google_community import GoogleSearchAPIWrapper
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from recommender.llm_clients import get_chat_model
+from recommender.llm_scheduler import (
+    Priority,
+    estimate_tokens,
+    llm_scheduler,
+)
 from recommender.messages import get_system_message
 from recommender.product_db import (
     get_product_from_db,
@@ -49,11 +54,13 @@ class Agent:
         temperature: float = 0.1,
         information_type: str = "product",
         search_engine_name: str = "ddg",
+        priority: Priority = Priority.INTERACTIVE,
     ):
         self.model_name = model_name
         self.temperature = temperature
         self.information_type = information_type
-        self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+        self.priority = priority
+        self.llm = get_chat_model(model_name, temperature)
         self.current_year = datetime.now().year
         self.search_engine_name = search_engine_name
 
@@ -135,7 +142,7 @@ class Agent:
     ) -> Optional[Dict]:
         """Process and validate information"""
         llm_with_tools = self.llm.bind_tools([search_tool])
-        ai_msg = llm_with_tools.invoke(messages)
+        ai_msg = await self._invoke(llm_with_tools, messages)
         messages.append(ai_msg)
 
         iteration = 0
@@ -151,12 +158,21 @@ class Agent:
                 )
             )
 
-            ai_msg = llm_with_tools.invoke(messages)
+            ai_msg = await self._invoke(llm_with_tools, messages)
             messages.append(ai_msg)
             iteration += 1
 
         return await self._save_information(ai_msg, messages, query, timeframe)
 
+    async def _invoke(self, llm_with_tools, messages: List):
+        """Invoke the model through the shared LLM scheduler"""
+        return await llm_scheduler.submit(
+            lambda: llm_with_tools.ainvoke(messages),
+            model=self.model_name,
+            estimated_tokens=estimate_tokens(str(messages)),
+            priority=self.priority,
+        )
+
     async def _handle_tool_calls(
         self,
         ai_msg,
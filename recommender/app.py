@@ -1,5 +1,10 @@
+import asyncio
+import json
 import logging
+import os
+from contextlib import AsyncExitStack
 from datetime import timedelta
+from typing import Optional
 
 import uvicorn
 from fastapi import Depends, FastAPI, Header, HTTPException, status
@@ -7,7 +12,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.responses import RedirectResponse
+from starlette.responses import (
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 
 from recommender.analytics import (
     format_analytics_result,
@@ -18,28 +27,70 @@ from recommender.auth import (
     create_access_token,
     create_user,
     get_current_user,
+    get_current_user_with_history,
+    get_optional_current_user,
+    get_user_by_id,
+    principal_cache,
+    user_options,
+)
+from recommender.canonicalize import (
+    canonical_query,
+    get_canonicalization_stats,
+    resolve_query,
+    search_text_for,
 )
-from recommender.database import get_db, init_db
+from recommender.collect_data import collect_search_data
+from recommender.database import async_session, get_db, init_db
 from recommender.environment_vars import ORIGIN, REDIRECT_URL
-from recommender.fetch_youtube_data import search_youtube_videos
+from recommender.extraction_cache import purge_expired_extractions
+from recommender.http_client import (
+    close_http_client,
+    get_http_pool_stats,
+    start_http_client,
+)
+from recommender.llm_clients import get_client_stats
+from recommender.llm_scheduler import Priority, llm_scheduler
 from recommender.models import (
     SearchHistory,
     User,
 )
-from recommender.process_submissions import (
-    process_submission,
-    process_submissions,
-)
+from recommender.password_hashing import password_hasher
 from recommender.product_catalogue import ProductCatalogue
+from recommender.prompt_builder import get_prompt_stats, preload_encoding
+from recommender.reddit_client_pool import reddit_client_pool
 from recommender.reddit_service import RedditService
+from recommender.result_cache import result_cache
 from recommender.save_data import (
     get_existing_search_queries,
+    get_latest_submission,
     load_structured_output,
+    merge_structured_output,
     save_data,
+    save_structured_output,
+    submission_created_at,
+)
+from recommender.schemas import (
+    Principal,
+    SearchAnalytic,
+    UserCreate,
+    UserResponse,
 )
-from recommender.schemas import SearchAnalytic, UserCreate, UserResponse
-from recommender.structured_output import process_all_posts
+from recommender.search_jobs import (
+    SEARCH_JOB_POLL_SECONDS,
+    TERMINAL_STATUSES,
+    enqueue_search_job,
+    get_search_job,
+    search_job_workers,
+)
+from recommender.single_flight import search_flight
+from recommender.structured_output import (
+    aggregate_decision,
+    process_all_posts,
+    stream_all_posts,
+)
+from recommender.triage import get_triage_stats, triage_posts
 from recommender.utils import autocomplete, filter_data
+from recommender.warmer import WARMER_ENABLED, warmer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -55,16 +106,75 @@ app.add_middleware(
 )
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Required in the X-Admin-Token header by admin endpoints; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    await start_http_client()
+    await preload_encoding()
+    reddit_client_pool.start()
+    result_cache.start()
+    await purge_expired_extractions()
+    search_job_workers.start(_run_search_job)
+    if WARMER_ENABLED:
+        warmer.start(_warm_search)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await search_job_workers.stop()
+    await warmer.stop()
+    await close_http_client()
+    await reddit_client_pool.stop()
+    await result_cache.stop()
+    password_hasher.shutdown()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime statistics for monitoring"""
+    return {
+        "auth_cache": principal_cache.get_stats(),
+        "canonicalization": get_canonicalization_stats(),
+        "http_client": get_http_pool_stats(),
+        "llm_clients": get_client_stats(),
+        "llm_scheduler": llm_scheduler.get_stats(),
+        "password_hashing": password_hasher.get_stats(),
+        "prompt_compaction": get_prompt_stats(),
+        "reddit_clients": reddit_client_pool.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "triage": get_triage_stats(),
+        "warmer": warmer.stats,
+        "search_single_flight": {
+            **search_flight.stats,
+            "in_flight": search_flight.in_flight(),
+        },
+    }
+
+
+@app.delete("/admin/cache/{search_query}")
+async def invalidate_cached_result(
+    search_query: str,
+    admin_token: str = Header(None, alias="X-Admin-Token"),
+):
+    """Invalidate the cached result of a query"""
+    if not ADMIN_TOKEN or admin_token != ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized"
+        )
+    normalized_query = await canonical_query(search_query)
+    stored = await result_cache.invalidate(normalized_query)
+    return {"search_query": normalized_query, "invalidated": stored}
 
 
 @app.get("/users/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    """Get current user information"""
+async def get_current_user_info(
+    current_user: User = Depends(get_current_user_with_history),
+):
+    """Get current user information, including the search history"""
     if not current_user.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user"
@@ -74,12 +184,18 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 @app.get("/reddit/status")
 async def reddit_status(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """Check Reddit authentication status"""
-    user = await db.execute(select(User).filter(User.id == current_user.id))
-    user = user.scalar_one_or_none()
+    user = await db.execute(
+        select(
+            User.has_reddit_refresh_token,
+            User.reddit_username,
+            User.reddit_last_sync,
+        ).filter(User.id == current_user.id)
+    )
+    user = user.one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {
@@ -91,27 +207,30 @@ async def reddit_status(
 
 @app.post("/reddit/deactivate")
 async def deactivate_reddit(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """Deactivate Reddit connection for the current user"""
-    user = await db.execute(select(User).filter(User.id == current_user.id))
-    user = user.scalar_one_or_none()
+    user = await get_user_by_id(db, current_user.id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    if user.reddit_refresh_token:
+        await reddit_client_pool.evict(user.reddit_refresh_token)
+
     # Clear Reddit-related fields
     user.has_reddit_refresh_token = False
     user.reddit_refresh_token = None
     user.reddit_state = None
     await db.commit()
+    principal_cache.invalidate_user(user.id)
 
     return {"detail": "Reddit connection successfully deactivated"}
 
 
 @app.get("/user/recent-searches", response_model=list[SearchAnalytic])
 async def get_recent_searches(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
     limit: int = 3,
 ):
@@ -149,12 +268,15 @@ async def login(
 
 @app.get("/reddit/auth")
 async def reddit_auth(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """Initialize Reddit authentication process for app-level access"""
+    user = await get_user_by_id(db, current_user.id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     reddit_service = RedditService(db)
-    auth_url, _ = await reddit_service.get_auth_url(current_user)
+    auth_url, _ = await reddit_service.get_auth_url(user)
     return {"url": auth_url}
 
 
@@ -166,11 +288,17 @@ async def reddit_callback(
 ):
     """Handle Reddit OAuth callback"""
 
-    user = await db.execute(select(User).filter(User.reddit_state == state))
+    user = await db.execute(
+        select(User)
+        .filter(User.reddit_state == state)
+        .options(*user_options())
+    )
     user = user.scalar_one_or_none()
     reddit_service = RedditService(db)
 
     success = await reddit_service.handle_callback(code, state, user)
+    if user:
+        principal_cache.invalidate_user(user.id)
 
     redirect_url = REDIRECT_URL
     if success:
@@ -203,13 +331,14 @@ async def similar_products(
             )
 
         logger.info(f"Searching for similar products for: {product_name}")
-        normalized_product_name = product_name.lower()
+        # The catalogue is keyed by the stored product names
+        _, product_text = await resolve_query(product_name)
 
         product_catalogue = ProductCatalogue()
         await product_catalogue.initialize()
 
         similar_products = await product_catalogue.get_similar_product(
-            normalized_product_name
+            product_text.lower()
         )
         logger.info(f"Found similar products: {similar_products}")
         
@@ -226,16 +355,51 @@ async def similar_products(
 async def search(
     search_query: str,
     #current_user: User = Depends(get_current_user),
-   # db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     limit: int = 2,
     batch_size: int = 20,
+    pack: bool = False,
+    background: bool = False,
     skip_history: bool = Header(False, alias="X-Skip-History"),
 ):
-    normalized_query = search_query.lower()
+    normalized_query, search_text = await resolve_query(search_query)
 
     try:
+        if background:
+            # Answer from the cache, otherwise hand the search to a worker
+            cached = await _get_cached_result(
+                normalized_query, db, limit, batch_size, pack, search_text
+            )
+            if cached:
+                return cached
+            job = await enqueue_search_job(
+                normalized_query,
+                {
+                    "limit": limit,
+                    "batch_size": batch_size,
+                    "pack": pack,
+                    "search_text": search_text,
+                },
+            )
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "job_id": job["job_id"],
+                    "status": job["status"],
+                    "status_url": f"/search/jobs/{job['job_id']}",
+                },
+            )
+
         results = await _execute_main_search(
-            normalized_query, None, None, limit, batch_size, skip_history
+            normalized_query,
+            None,
+            db,
+            limit,
+            batch_size,
+            skip_history,
+            pack=pack,
+            raw_query=search_query,
+            search_text=search_text,
         )
         return results
     except Exception as e:
@@ -251,80 +415,282 @@ async def search(
         }
 
 
-async def _execute_main_search(
-    query, current_user, db, limit, batch_size, skip_history
+@app.get("/search/jobs/{job_id}")
+async def search_job_status(job_id: str):
+    """Poll a background search job; the result has the /search schema"""
+    job = await get_search_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/search/jobs/{job_id}/events")
+async def search_job_events(job_id: str):
+    """Subscribe to a background search job until it completes"""
+    job = await get_search_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield _sse_event("status", current)
+            if current["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(SEARCH_JOB_POLL_SECONDS)
+            current = await get_search_job(job_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _run_search_pipeline(
+    query,
+    current_user,
+    limit,
+    batch_size,
+    pack=False,
+    priority=Priority.INTERACTIVE,
+    search_text=None,
 ):
-    try:
-        # Skip history when no user is logged in
-        if current_user is None:
-            skip_history = True
-            
-        # Check cache first (skip if no db connection)
-        structured_output = None
-        if db:
-            structured_output = await load_structured_output(query, db=db)
-        
-        if structured_output:
-            if not skip_history and current_user and db:
-                await _update_search_history(
-                    current_user, query, structured_output, db
-                )
-            return filter_data(structured_output)
+    """
+    Run the search pipeline and store its result, raising on failure.
 
+    `query` is the canonical query keying the result, `search_text` what
+    is searched for and analyzed, by default the catalogue product name.
+    The pipeline uses its own session since it can outlive the request
+    that started it.
+    """
+    search_text = search_text or await search_text_for(query)
+    async with async_session() as db:
+        all_submissions, _ = await _collect_submissions(
+            query, search_text, current_user, db, limit, priority=priority
+        )
+        results = await process_all_posts(
+            all_submissions,
+            search_text,
+            batch_size,
+            priority=priority,
+            pack=pack,
+        )
+        results = await _store_result(query, filter_data(results), db)
 
-        # Initialize services
-        reddit_search_results = []
-        youtube_data = []
+    result_cache.set(query, results)
+    return results
 
-        
-        # Only try Reddit if we have a database and authenticated user
-        if db and current_user:
-            try:
-                reddit_service = RedditService(db=db)
-                reddit = await reddit_service.get_authorized_client(current_user)
-                subreddit = await reddit.subreddit("all")
-                async for submission in subreddit.search(query, limit=limit):
-                    reddit_search_results.append(submission)
-            except Exception as e:
-                logger.error(f"Reddit API error: {str(e)}")
-                # Continue with empty results if Reddit fails
 
-        # Get YouTube data
-        try:
-            youtube_data = await search_youtube_videos(query, max_results=limit)
-        except Exception as e:
-            logger.error(f"YouTube API error: {str(e)}")
-            youtube_data = []
+async def _run_streaming_pipeline(
+    query,
+    current_user,
+    limit,
+    batch_size,
+    emit,
+    pack=False,
+    search_text=None,
+):
+    """
+    Streaming counterpart of _run_search_pipeline, passing the progress,
+    review and decision events to `emit` as they happen
+    """
+    search_text = search_text or await search_text_for(query)
+    async with async_session() as db:
+        emit("progress", {"stage": "collecting"})
+        all_submissions, triage_stats = await _collect_submissions(
+            query, search_text, current_user, db, limit
+        )
+        emit("progress", {"stage": "triage", **triage_stats})
+
+        results = None
+        async for event in stream_all_posts(
+            all_submissions, search_text, batch_size, pack=pack
+        ):
+            if event["event"] == "result":
+                results = filter_data(event["data"])
+            else:
+                emit(event["event"], event["data"])
+        results = await _store_result(query, results, db)
+
+    result_cache.set(query, results)
+    return results
+
 
-        # Process results
-        process_whole_reddit_data = await process_submissions(
-            reddit_search_results
+async def _store_result(query, results, db):
+    """Store a computed result, returning it with its id when stored"""
+    try:
+        structured_output_id = await save_structured_output(
+            query, results, db, replace=True
         )
-        processed_reddit_submissions = [
-            await process_submission(data) for data in process_whole_reddit_data
-        ]
+        return {**results, "id": structured_output_id, "search_query": query}
+    except Exception as e:
+        logger.error(f"Error saving structured output: {str(e)}")
+        await db.rollback()
+        return results
 
-        all_submissions = {
-            query: [
-                {
-                    "reddit": processed_reddit_submissions,
-                    "youtube": youtube_data,
-                }
-            ]
-        }
-        if db:
-            await save_data(all_submissions, db=db)
-        
-        results = await process_all_posts(all_submissions, query, batch_size)
-        filtered_results = filter_data(results)
 
+async def _run_incremental_refresh(
+    query,
+    current_user,
+    limit,
+    batch_size,
+    pack=False,
+    priority=Priority.BACKGROUND,
+    search_text=None,
+):
+    """
+    Refresh a stored result with the posts published since the last run.
+
+    Only the new posts are analyzed; their reviews are merged into the
+    stored result and the overall decision is recomputed from all of its
+    reviews. Queries without a stored result run the full pipeline.
+    """
+    search_text = search_text or await search_text_for(query)
+    async with async_session() as db:
+        latest = await get_latest_submission(query, db)
+        stored = await load_structured_output(query, db)
+        if latest is None or stored is None:
+            return await _run_search_pipeline(
+                query,
+                current_user,
+                limit,
+                batch_size,
+                pack=pack,
+                priority=priority,
+                search_text=search_text,
+            )
+
+        collected = await _collect_posts(
+            search_text, current_user, db, limit, newer_than=latest
+        )
+        new_submissions, triage_stats = await _triage_collected(
+            search_text, collected, newer_than=latest, priority=priority
+        )
+        reviews = []
+        if triage_stats["kept"]:
+            results = await process_all_posts(
+                new_submissions,
+                search_text,
+                batch_size,
+                priority=priority,
+                pack=pack,
+            )
+            reviews = filter_data(results)["reviews"]
+
+        # The newest stored post is the next refresh's watermark, so the
+        # posts are only stored with the reviews of a successful analysis
+        await save_data({query: [collected]}, db=db, commit=False)
+        await merge_structured_output(
+            query,
+            reviews,
+            db,
+            decide=lambda merged: aggregate_decision(merged, search_text),
+        )
+        results = filter_data(await load_structured_output(query, db))
+
+    result_cache.set(query, results)
+    return results
+
+
+async def _refresh_search(
+    query, limit=2, batch_size=20, pack=False, search_text=None
+):
+    """Refresh a stale result in the background"""
+    return await search_flight.run(
+        query,
+        lambda: _run_incremental_refresh(
+            query, None, limit, batch_size, pack=pack, search_text=search_text
+        ),
+    )
+
+
+async def _warm_search(query, limit=2, batch_size=20):
+    """
+    Warmer runner, refreshing a popular query at background priority.
+
+    It does not go through search_flight: a search joining the warmer's
+    work would wait at background priority and fail with the warmer's
+    spend budget. The warmer skips queries already in flight instead.
+    """
+    return await _run_incremental_refresh(query, None, limit, batch_size)
+
+
+async def _get_cached_result(
+    query, db, limit, batch_size, pack=False, search_text=None
+):
+    """Cached result for a query, refreshing it in the background if stale"""
+    return await result_cache.get(
+        query,
+        db,
+        revalidate=lambda: _refresh_search(
+            query, limit, batch_size, pack, search_text
+        ),
+        transform=filter_data,
+    )
+
+
+async def _stored_result(query):
+    """Fresh stored result of a query, checked under the advisory lock"""
+    return await result_cache.get(query, transform=filter_data)
+
+
+async def _run_search_job(
+    query, limit=2, batch_size=20, pack=False, search_text=None
+):
+    """Background job runner, sharing in-flight work with live searches"""
+    return await search_flight.run(
+        query,
+        lambda: _run_search_pipeline(
+            query, None, limit, batch_size, pack=pack, search_text=search_text
+        ),
+        recheck=lambda: _stored_result(query),
+    )
+
+
+async def _execute_main_search(
+    query,
+    current_user,
+    db,
+    limit,
+    batch_size,
+    skip_history,
+    pack=False,
+    raw_query=None,
+    search_text=None,
+):
+    try:
+        # Skip history when no user is logged in
+        if current_user is None:
+            skip_history = True
+
+        results = await _get_cached_result(
+            query, db, limit, batch_size, pack, search_text
+        )
+        if results is None:
+            # Identical concurrent searches share one pipeline execution
+            results = await search_flight.run(
+                query,
+                lambda: _run_search_pipeline(
+                    query,
+                    current_user,
+                    limit,
+                    batch_size,
+                    pack=pack,
+                    search_text=search_text,
+                ),
+                recheck=lambda: _stored_result(query),
+            )
 
         if not skip_history and current_user and db:
             await _update_search_history(
-                current_user, query, filtered_results, db
+                current_user, query, raw_query or query, results, db
             )
 
-        return filtered_results
+        return results
 
     except Exception as e:
         logger.error(f"Error in main search execution: {str(e)}", exc_info=True)
@@ -340,7 +706,165 @@ async def _execute_main_search(
         }
 
 
-async def _update_search_history(current_user, query, structured_output, db):
+async def _collect_posts(
+    search_text, current_user, db, limit, newer_than=None
+):
+    """Search Reddit and YouTube for `search_text`"""
+    async with AsyncExitStack() as stack:
+        # Only try Reddit if we have a database and authenticated user;
+        # the pooled client is leased until the collection finishes
+        reddit = None
+        if db and current_user:
+            try:
+                reddit_service = RedditService(db=db)
+                reddit = await stack.enter_async_context(
+                    reddit_service.authorized_client(current_user)
+                )
+            except Exception as e:
+                logger.error(f"Reddit API error: {str(e)}")
+                # Continue with YouTube only if Reddit fails
+
+        # Refreshes only search and load posts newer than the stored ones
+        return await collect_search_data(
+            search_text, reddit=reddit, limit=limit, newer_than=newer_than
+        )
+
+
+async def _triage_collected(
+    search_text, collected, newer_than=None, priority=Priority.INTERACTIVE
+):
+    """
+    Triage collected posts at `priority`, keeping only the posts created
+    after `newer_than` when given. The submissions are returned keyed by
+    `search_text`, for the analysis.
+    """
+    if newer_than is not None:
+        # Upstream time filters are coarse; drop what they let through
+        collected = {
+            source: [
+                submission
+                for submission in collected[source]
+                if submission_created_at(submission, source) > newer_than
+            ]
+            for source in ["reddit", "youtube"]
+        }
+
+    return await triage_posts(
+        {search_text: [collected]}, search_text, priority=priority
+    )
+
+
+async def _collect_submissions(
+    query, search_text, current_user, db, limit, priority=Priority.INTERACTIVE
+):
+    """
+    Collect, persist and triage posts for a query.
+
+    Posts are searched for and triaged by `search_text` and stored under
+    the canonical `query`.
+    """
+    collected = await _collect_posts(search_text, current_user, db, limit)
+    if db:
+        await save_data({query: [collected]}, db=db)
+    return await _triage_collected(search_text, collected, priority=priority)
+
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.get("/search/{search_query}/stream")
+async def search_stream(
+    search_query: str,
+    current_user: Optional[Principal] = Depends(get_optional_current_user),
+    limit: int = 2,
+    batch_size: int = 20,
+    pack: bool = False,
+    skip_history: bool = Header(False, alias="X-Skip-History"),
+):
+    """
+    Stream search results as Server-Sent Events.
+
+    Emits progress events, each review as soon as its post is analyzed and
+    a provisional overall decision as reviews arrive, followed by a final
+    result event with the same payload as /search. A stream joining an
+    identical search already running only receives its final result.
+    """
+    normalized_query, search_text = await resolve_query(search_query)
+
+    async def events():
+        # The request's session from get_db is closed before the response
+        # body runs, so the stream opens its own
+        next_event = None
+        try:
+            async with async_session() as db:
+                results = await _get_cached_result(
+                    normalized_query, db, limit, batch_size, pack, search_text
+                )
+                if results is None:
+                    if search_flight.is_in_flight(normalized_query):
+                        yield _sse_event("progress", {"stage": "joined"})
+
+                    queue = asyncio.Queue()
+                    flight = asyncio.ensure_future(
+                        search_flight.run(
+                            normalized_query,
+                            lambda: _run_streaming_pipeline(
+                                normalized_query,
+                                current_user,
+                                limit,
+                                batch_size,
+                                lambda event, data: queue.put_nowait(
+                                    (event, data)
+                                ),
+                                pack=pack,
+                                search_text=search_text,
+                            ),
+                            recheck=lambda: _stored_result(normalized_query),
+                        )
+                    )
+                    while not flight.done() or not queue.empty():
+                        next_event = asyncio.ensure_future(queue.get())
+                        await asyncio.wait(
+                            {next_event, flight},
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        if next_event.done():
+                            yield _sse_event(*next_event.result())
+                        else:
+                            next_event.cancel()
+                    results = flight.result()
+
+                if current_user and not skip_history:
+                    await _update_search_history(
+                        current_user,
+                        normalized_query,
+                        search_query,
+                        results,
+                        db,
+                    )
+            yield _sse_event("result", results)
+        except Exception as e:
+            logger.error(f"Streaming search error: {str(e)}", exc_info=True)
+            yield _sse_event(
+                "error",
+                {"detail": "An error occurred while processing your search."},
+            )
+        finally:
+            # Don't leave a queue reader behind when the client disconnects
+            if next_event is not None and not next_event.done():
+                next_event.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _update_search_history(
+    current_user, query, raw_query, structured_output, db
+):
     try:
         # First await the execute
         result = await db.execute(
@@ -350,13 +874,16 @@ async def _update_search_history(current_user, query, structured_output, db):
             )
         )
         # Then get the scalar result
-        existing_history = await result.scalar_one_or_none()
+        existing_history = result.scalar_one_or_none()
 
         if not existing_history:
+            # The raw query is kept to measure how canonicalization merges
+            # searches
             search_history = SearchHistory(
                 user_id=current_user.id,
                 search_query=query,
-                structured_output_id=structured_output["id"],
+                raw_search_query=raw_query,
+                structured_output_id=structured_output.get("id"),
             )
             db.add(search_history)
             await db.commit()
@@ -367,7 +894,7 @@ async def _update_search_history(current_user, query, structured_output, db):
 
 @app.get("/user/search-analytics", response_model=list[SearchAnalytic])
 async def get_user_search_history(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """Get analytics for the current user's search history"""
@@ -1,32 +1,50 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload, selectinload
 
 from recommender.database import get_db
 from recommender.environment_vars import JWT_SECRET_KEY
-from recommender.models import User
+from recommender.models import SearchHistory, StructuredOutput, User
+from recommender.password_hashing import password_hasher
+from recommender.schemas import Principal
 
 # Configuration
 SECRET_KEY = JWT_SECRET_KEY
 ALGORITHM = "HS256"
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Bounds how long a change made by another process can go unnoticed
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="token", auto_error=False
+)
 
+PRINCIPAL_COLUMNS = (
+    User.id,
+    User.username,
+    User.is_active,
+    User.has_reddit_refresh_token,
+)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
 
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -40,34 +58,185 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of verified tokens and the principals they authenticate.
+
+    Entries expire at the token's exp, or after AUTH_CACHE_TTL_SECONDS if
+    that comes first, and are dropped for a user whose account or Reddit
+    connection changes. Tokens are stored as digests.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = AUTH_CACHE_SIZE,
+        ttl_seconds: float = AUTH_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, Tuple[Principal, float]] = (
+            OrderedDict()
+        )
+        self._keys_by_user: Dict[int, Set[str]] = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[Principal]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                self._remove(key)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def set(self, token: str, principal: Principal, exp: Optional[float]):
+        expires_at = time.time() + self.ttl_seconds
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        key = self._key(token)
+        self._entries[key] = (principal, expires_at)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(principal.id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        principal, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(principal.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[principal.id]
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached token of a user"""
+        self.stats["invalidations"] += 1
+        for key in list(self._keys_by_user.get(user_id, ())):
+            self._remove(key)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "entries": len(self._entries)}
+
+
+principal_cache = PrincipalCache()
+
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        if payload.get("sub") is None:
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    return payload
+
+
+def _token_username(token: str) -> str:
+    return _decode_token(token)["sub"]
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> Principal:
+    """
+    Authenticate the request. Tokens verified before are answered from
+    the principal cache without decoding or querying the database.
+    """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    payload = _decode_token(token)
+    principal = await get_principal_by_username(db, payload["sub"])
+    if principal is None:
+        raise _credentials_exception()
+    principal_cache.set(token, principal, payload.get("exp"))
+    return principal
+
+
+async def get_optional_current_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+) -> Optional[Principal]:
+    """Authenticate the request if it carries a token, None otherwise"""
+    if token is None:
+        return None
+    return await get_current_user(token, db)
 
-    user = await get_user_by_username(db, username)
 
+async def get_current_user_with_history(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> User:
+    """Authenticate the request and load the user's full search history"""
+    user = await get_user_by_username(
+        db, _token_username(token), with_history=True
+    )
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
 
-async def get_user_by_username(
+async def get_principal_by_username(
     db: AsyncSession, username: str
+) -> Optional[Principal]:
+    """Get the columns of a user needed for authentication"""
+    result = await db.execute(
+        select(*PRINCIPAL_COLUMNS).filter(User.username == username)
+    )
+    row = result.one_or_none()
+    return Principal.model_validate(row) if row else None
+
+
+def user_options(with_history: bool = False):
+    """
+    Loader options for User queries. The search history, with its outputs
+    and their reviews, is only loaded when asked for.
+    """
+    if not with_history:
+        return [noload(User.search_history)]
+    return [
+        selectinload(User.search_history)
+        .selectinload(SearchHistory.structured_output)
+        .selectinload(StructuredOutput.reviews)
+    ]
+
+
+async def get_user_by_username(
+    db: AsyncSession, username: str, with_history: bool = False
 ) -> Optional[User]:
     """Get user by username"""
-    user = await db.execute(select(User).filter(User.username == username))
+    user = await db.execute(
+        select(User)
+        .filter(User.username == username)
+        .options(*user_options(with_history))
+    )
+    return user.scalar_one_or_none()
+
+
+async def get_user_by_id(
+    db: AsyncSession, user_id: int, with_history: bool = False
+) -> Optional[User]:
+    """Get user by id"""
+    user = await db.execute(
+        select(User)
+        .filter(User.id == user_id)
+        .options(*user_options(with_history))
+    )
     return user.scalar_one_or_none()
 
 
@@ -78,8 +247,15 @@ async def authenticate_user(
     user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify_and_update(
+        password, user.hashed_password
+    )
+    if not valid:
         return None
+    if new_hash:
+        # The cost factor changed since the password was hashed
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
@@ -96,7 +272,7 @@ async def create_user(
             status_code=400, detail="Username already registered"
         )
 
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     user = User(
         username=username,
         email=email,
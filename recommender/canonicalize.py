@@ -0,0 +1,239 @@
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from recommender.database import async_session
+from recommender.models import ProductModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often the product catalogue aliases are reloaded
+CANONICAL_ALIAS_TTL_SECONDS = float(
+    os.getenv("CANONICAL_ALIAS_TTL_SECONDS", "600")
+)
+
+# Words that do not change which product a query is about
+STOPWORDS = {
+    "a",
+    "an",
+    "the",
+    "for",
+    "of",
+    "is",
+    "it",
+    "should",
+    "i",
+    "buy",
+    "worth",
+    "review",
+    "reviews",
+    "reviewed",
+    "honest",
+    "opinion",
+    "opinions",
+    "vs",
+    "versus",
+}
+
+UNITS = {
+    "gb": "gb",
+    "tb": "tb",
+    "mb": "mb",
+    "mah": "mah",
+    "hz": "hz",
+    "khz": "khz",
+    "mm": "mm",
+    "cm": "cm",
+    "inch": "in",
+    "inches": "in",
+    '"': "in",
+    "w": "w",
+    "mp": "mp",
+}
+
+UNIT_PATTERN = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(gb|tb|mb|mah|khz|hz|mm|cm|inches|inch|w|mp|")'
+    r"(?![a-z0-9])"
+)
+# Hyphens and slashes between letters and digits of model numbers, e.g.
+# "wh-1000xm5" or "s-24"; number ranges such as "70-200mm" stay apart
+JOINER_PATTERN = re.compile(
+    r"(?<=[a-z])[-_/](?=[0-9])|(?<=[0-9])[-_/](?=[a-z])"
+)
+DECIMAL_PATTERN = re.compile(r"(?<=\d)\.(?=\d)")
+PUNCTUATION_PATTERN = re.compile(r"[^a-z0-9\s\x00]+")
+# Letters run into a model number, e.g. "iphone16" or "rtx4090"
+WORD_NUMBER_PATTERN = re.compile(r"^([a-z]{3,})(\d+)([a-z]{3,})?$")
+# Model numbers split from their letters, e.g. "s 24" or "m 3"
+SPLIT_MODEL_PATTERN = re.compile(r"\b([a-z]) (\d+)\b")
+
+_aliases: Dict[str, str] = {}
+# Catalogue product names as stored, and their categories, by canonical
+# form
+_product_names: Dict[str, str] = {}
+_categories: Dict[str, Optional[str]] = {}
+_aliases_loaded_at: Optional[float] = None
+_stats = {"queries": 0, "rewritten": 0, "aliased": 0}
+
+
+def _normalize_unit(match: re.Match) -> str:
+    return f"{match.group(1)}{UNITS[match.group(2)]} "
+
+
+def _split_token(token: str) -> List[str]:
+    match = WORD_NUMBER_PATTERN.match(token)
+    if not match:
+        return [token]
+    return [part for part in match.groups() if part]
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query's spelling without consulting the catalogue.
+
+    Lowercases, folds units ("256 GB" -> "256gb", '6.1"' -> "6.1in"),
+    joins model numbers ("WH-1000XM5" -> "wh1000xm5", "S 24" -> "s24"),
+    splits words run into numbers ("iphone16" -> "iphone 16"), drops
+    punctuation and stopwords and collapses whitespace.
+    """
+    text = (query or "").lower()
+    text = UNIT_PATTERN.sub(_normalize_unit, text)
+    text = JOINER_PATTERN.sub("", text)
+    # Protect decimal points from the punctuation pass
+    text = DECIMAL_PATTERN.sub("\x00", text)
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    text = SPLIT_MODEL_PATTERN.sub(r"\1\2", text)
+
+    tokens = []
+    for token in text.split():
+        tokens.extend(_split_token(token.replace("\x00", ".")))
+    words = [token for token in tokens if token not in STOPWORDS]
+    # A query made only of stopwords keeps them
+    return " ".join(words or tokens)
+
+
+def _compact(query: str) -> str:
+    return query.replace(" ", "")
+
+
+def _add_alias(alias: str, product_name: str):
+    if alias:
+        _aliases.setdefault(_compact(alias), product_name)
+
+
+async def load_aliases():
+    """Map normalized catalogue product names, with and without brand"""
+    async with async_session() as db:
+        result = await db.execute(
+            select(
+                ProductModel.product_name,
+                ProductModel.brand,
+                ProductModel.category,
+            )
+        )
+        products = result.all()
+
+    _aliases.clear()
+    _product_names.clear()
+    _categories.clear()
+    for product_name, brand, category in products:
+        if not product_name:
+            continue
+        canonical = normalize_query(product_name)
+        _product_names.setdefault(canonical, product_name)
+        _categories.setdefault(canonical, category)
+        _add_alias(canonical, canonical)
+        brand = normalize_query(brand or "")
+        if brand and canonical.startswith(f"{brand} "):
+            _add_alias(canonical[len(brand) + 1 :], canonical)
+    logger.info(f"Loaded {len(_aliases)} product aliases")
+
+
+def canonicalize(query: str) -> str:
+    """Canonical form of a query using the aliases loaded so far"""
+    _stats["queries"] += 1
+    normalized = normalize_query(query)
+    canonical = _aliases.get(_compact(normalized), normalized)
+    if canonical != normalized:
+        _stats["aliased"] += 1
+    if canonical != " ".join((query or "").lower().split()):
+        _stats["rewritten"] += 1
+    return canonical
+
+
+async def _refresh_aliases():
+    """Reload the aliases when they are older than the TTL"""
+    global _aliases_loaded_at
+    if (
+        _aliases_loaded_at is None
+        or time.monotonic() - _aliases_loaded_at > CANONICAL_ALIAS_TTL_SECONDS
+    ):
+        # Failed loads are also retried after the TTL only
+        _aliases_loaded_at = time.monotonic()
+        try:
+            await load_aliases()
+        except Exception as e:
+            logger.error(f"Error loading product aliases: {str(e)}")
+
+
+async def canonical_query(query: str) -> str:
+    """
+    Canonical form of a query, used as the key for cached results, search
+    history and in-flight searches. It is not meant to be searched for.
+
+    Normalizes the query and maps it to the matching product catalogue
+    entry, if any, reloading the catalogue aliases when they are older
+    than CANONICAL_ALIAS_TTL_SECONDS.
+    """
+    await _refresh_aliases()
+    return canonicalize(query)
+
+
+async def resolve_query(query: str) -> Tuple[str, str]:
+    """
+    Canonical form of a query and the text to search for it.
+
+    The search text is the stored name of the catalogue product the query
+    maps to, otherwise the query as typed with its whitespace collapsed.
+    It is what the catalogue, Reddit, YouTube and the prompts receive.
+    """
+    canonical = await canonical_query(query)
+    text = _product_names.get(canonical) or " ".join((query or "").split())
+    return canonical, text
+
+
+async def search_text_for(canonical: str) -> str:
+    """
+    Search text for a canonical query when the typed query is unknown,
+    e.g. for background refreshes: the catalogue product name, if any
+    """
+    await _refresh_aliases()
+    return _product_names.get(canonical, canonical)
+
+
+async def product_category(query: str) -> Optional[str]:
+    """
+    Category of the catalogue product a query names.
+
+    Queries and product names are compared in canonical form, so that
+    spellings such as "sony wh1000xm5" and "Sony WH-1000XM5" match. A query
+    naming no product exactly gets the category of the shortest product
+    whose name contains it.
+    """
+    canonical = await canonical_query(query)
+    if canonical in _categories:
+        return _categories[canonical]
+    compact = _compact(canonical)
+    candidates = [name for name in _categories if compact in _compact(name)]
+    if not compact or not candidates:
+        return None
+    return _categories[min(candidates, key=len)]
+
+
+def get_canonicalization_stats() -> Dict[str, int]:
+    return {**_stats, "aliases": len(_aliases)}
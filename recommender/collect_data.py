@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from recommender.canonicalize import product_category
+from recommender.fetch_youtube_data import search_youtube_videos
+from recommender.process_submissions import (
+    process_submission,
+    rank_submissions,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDDIT_CONCURRENCY = int(os.getenv("REDDIT_CONCURRENCY", "5"))
+YOUTUBE_CONCURRENCY = int(os.getenv("YOUTUBE_CONCURRENCY", "5"))
+COLLECTION_DEADLINE_SECONDS = float(
+    os.getenv("COLLECTION_DEADLINE_SECONDS", "20")
+)
+# Time allowed for the subreddit searches, before loading submissions
+REDDIT_SEARCH_SECONDS = float(os.getenv("REDDIT_SEARCH_SECONDS", "8"))
+# Results requested from each subreddit; the best `limit` are loaded
+REDDIT_SUBREDDIT_LIMIT = int(os.getenv("REDDIT_SUBREDDIT_LIMIT", "10"))
+
+# Subreddits searched for product categories containing each key, in
+# addition to r/all. Extended or overridden with a JSON object in
+# REDDIT_CATEGORY_SUBREDDITS
+CATEGORY_SUBREDDITS = {
+    "phone": ["smartphones", "Android", "iphone", "PickAnAndroidForMe"],
+    "laptop": ["laptops", "SuggestALaptop", "macbook"],
+    "tablet": ["tablets", "ipad"],
+    "headphone": ["headphones", "HeadphoneAdvice", "audiophile"],
+    "earbud": ["headphones", "HeadphoneAdvice", "Earbuds"],
+    "speaker": ["audiophile", "BudgetAudiophile"],
+    "watch": ["smartwatch", "AppleWatch", "GalaxyWatch"],
+    "camera": ["photography", "Cameras", "AskPhotography"],
+    "tv": ["4kTV", "televisions"],
+    "monitor": ["Monitors", "buildapc"],
+    "console": ["gaming", "consoles"],
+    "keyboard": ["MechanicalKeyboards", "keyboards"],
+    "vacuum": ["RobotVacuums", "VacuumCleaners"],
+}
+CATEGORY_SUBREDDITS.update(
+    json.loads(os.getenv("REDDIT_CATEGORY_SUBREDDITS", "{}"))
+)
+DEFAULT_SUBREDDITS = ["all"]
+# Reddit search time filters, narrowest first, with the age they cover
+REDDIT_TIME_FILTERS = [
+    ("hour", timedelta(hours=1)),
+    ("day", timedelta(days=1)),
+    ("week", timedelta(weeks=1)),
+    ("month", timedelta(days=31)),
+    ("year", timedelta(days=365)),
+]
+
+
+def reddit_time_filter(newer_than: Optional[datetime]) -> str:
+    """Narrowest Reddit search time filter covering posts since a time"""
+    if newer_than is None:
+        return "all"
+    age = datetime.utcnow() - newer_than
+    for time_filter, covered in REDDIT_TIME_FILTERS:
+        if age <= covered:
+            return time_filter
+    return "all"
+
+
+def category_matches(key: str, category: str) -> bool:
+    """
+    Whether a lowercase category names the CATEGORY_SUBREDDITS key as a
+    whole word, in the plural or with a "smart" prefix: "phone" matches
+    "smartphones" but not "headphones"
+    """
+    pattern = rf"\b(?:smart)?{re.escape(key)}(?:e?s)?\b"
+    return re.search(pattern, category) is not None
+
+
+async def subreddits_for_query(query: str) -> List[str]:
+    """Subreddits to search for a query, from its product category"""
+    try:
+        category = (await product_category(query) or "").lower()
+    except Exception as e:
+        logger.error(f"Error looking up category for '{query}': {str(e)}")
+        category = ""
+
+    subreddits = list(DEFAULT_SUBREDDITS)
+    for key, names in CATEGORY_SUBREDDITS.items():
+        if category_matches(key, category):
+            subreddits.extend(
+                name for name in names if name not in subreddits
+            )
+    return subreddits
+
+
+async def search_subreddits(
+    reddit,
+    query: str,
+    subreddits: List[str],
+    limit: int = REDDIT_SUBREDDIT_LIMIT,
+    budget: Optional[float] = REDDIT_SEARCH_SECONDS,
+    newer_than: Optional[datetime] = None,
+) -> List:
+    """
+    Search several subreddits concurrently and merge the results.
+
+    Submissions are deduplicated by id. Searches still running when the
+    budget runs out are cancelled and keep the results they yielded. With
+    `newer_than`, a naive UTC time, the newest submissions are searched
+    and older ones are dropped.
+    """
+    found: Dict[str, object] = {}
+    options = {}
+    since = None
+    if newer_than is not None:
+        options = {
+            "sort": "new",
+            "time_filter": reddit_time_filter(newer_than),
+        }
+        since = newer_than.replace(tzinfo=timezone.utc).timestamp()
+
+    async def search(name: str):
+        subreddit = await reddit.subreddit(name)
+        async for submission in subreddit.search(
+            query, limit=limit, **options
+        ):
+            if since is not None and submission.created_utc <= since:
+                continue
+            found.setdefault(submission.id, submission)
+
+    tasks = {
+        asyncio.create_task(search(name)): name for name in subreddits
+    }
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(
+            f"Subreddit search for '{query}' exceeded {budget}s in "
+            f"{[tasks[task] for task in pending]}"
+        )
+        await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        if task.exception():
+            logger.error(
+                f"Error searching r/{tasks[task]}: {str(task.exception())}"
+            )
+
+    return list(found.values())
+
+
+async def _collect_reddit(
+    reddit,
+    query: str,
+    limit: int,
+    semaphore: asyncio.Semaphore,
+    results: Dict[int, Dict],
+    subreddits: Optional[List[str]] = None,
+    newer_than: Optional[datetime] = None,
+):
+    """
+    Search the query's subreddits and load the best `limit` candidate
+    submissions concurrently, only those created after `newer_than` when
+    given.
+
+    Loaded submissions are written into `results` as soon as they finish,
+    keyed by their rank, so that a caller hitting the deadline still sees
+    everything that completed.
+    """
+    if subreddits is None:
+        subreddits = await subreddits_for_query(query)
+    submissions = await search_subreddits(
+        reddit,
+        query,
+        subreddits,
+        limit=max(limit, REDDIT_SUBREDDIT_LIMIT),
+        newer_than=newer_than,
+    )
+    candidates = (await rank_submissions(submissions))[:limit]
+    logger.info(
+        f"Loading {len(candidates)} of {len(submissions)} submissions "
+        f"found in {subreddits}"
+    )
+
+    async def load(rank: int, submission):
+        async with semaphore:
+            try:
+                results[rank] = await process_submission(submission)
+            except Exception as e:
+                logger.error(
+                    f"Error loading submission {submission.id}: {str(e)}"
+                )
+
+    await asyncio.gather(
+        *(load(rank, submission) for rank, submission in enumerate(candidates))
+    )
+
+
+async def _collect_youtube(
+    query: str,
+    limit: int,
+    concurrency: int,
+    results: Dict[int, Dict],
+    newer_than: Optional[datetime] = None,
+):
+    """
+    Search YouTube, writing each video into `results` under its search
+    rank as soon as it is enriched, so that a caller hitting the deadline
+    still sees everything that completed
+    """
+    await search_youtube_videos(
+        query,
+        max_results=limit,
+        concurrency=concurrency,
+        published_after=newer_than,
+        results=results,
+    )
+
+
+async def collect_search_data(
+    query: str,
+    reddit=None,
+    limit: int = 2,
+    reddit_concurrency: int = REDDIT_CONCURRENCY,
+    youtube_concurrency: int = YOUTUBE_CONCURRENCY,
+    deadline: Optional[float] = COLLECTION_DEADLINE_SECONDS,
+    subreddits: Optional[List[str]] = None,
+    newer_than: Optional[datetime] = None,
+) -> Dict[str, List[Dict]]:
+    """
+    Collect Reddit and YouTube data for a query concurrently.
+
+    Args:
+        query: Search query string
+        reddit: Authorized asyncpraw client, or None to skip Reddit
+        limit: Maximum number of results per source
+        reddit_concurrency: Maximum concurrent submission loads
+        youtube_concurrency: Maximum concurrent YouTube requests
+        deadline: Overall time budget in seconds, None to wait for all
+        subreddits: Subreddits to search, by default r/all plus those
+            mapped from the product's catalogue category
+        newer_than: Only search posts created after this naive UTC time,
+            so that no older submission or video is loaded
+
+    Returns:
+        Dictionary with "reddit" and "youtube" lists containing whatever
+        finished before the deadline
+    """
+    reddit_results: Dict[int, Dict] = {}
+    youtube_results: Dict[int, Dict] = {}
+
+    tasks = {
+        asyncio.create_task(
+            _collect_youtube(
+                query,
+                limit,
+                youtube_concurrency,
+                youtube_results,
+                newer_than,
+            )
+        ): "youtube"
+    }
+    if reddit is not None:
+        tasks[
+            asyncio.create_task(
+                _collect_reddit(
+                    reddit,
+                    query,
+                    limit,
+                    asyncio.Semaphore(reddit_concurrency),
+                    reddit_results,
+                    subreddits,
+                    newer_than,
+                )
+            )
+        ] = "reddit"
+
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+    for task in pending:
+        logger.warning(
+            f"{tasks[task]} collection for '{query}' exceeded "
+            f"{deadline}s deadline, returning partial results"
+        )
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    for task in done:
+        if task.exception():
+            logger.error(
+                f"{tasks[task]} collection error: {str(task.exception())}"
+            )
+
+    return {
+        "reddit": [reddit_results[rank] for rank in sorted(reddit_results)],
+        "youtube": [youtube_results[rank] for rank in sorted(youtube_results)],
+    }
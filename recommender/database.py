@@ -1,6 +1,8 @@
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from recommender.environment_vars import DATABASE_URL
 
@@ -10,6 +12,10 @@ async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
 )
 
+# Long-held connections, for advisory locks and notifications, are opened
+# outside the pool used by requests
+dedicated_engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+
 Base = declarative_base()
 
 
@@ -19,7 +25,9 @@ def register_models():
         Posts,
         ProductModel,
         Review,
+        ReviewExtraction,
         SearchHistory,
+        SearchJob,
         StructuredOutput,
         User,
     )
@@ -30,6 +38,21 @@ async def init_db():
     register_models()
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all does not add columns to existing tables
+        await conn.execute(
+            text(
+                "ALTER TABLE search_history "
+                "ADD COLUMN IF NOT EXISTS raw_search_query VARCHAR"
+            )
+        )
+        await conn.execute(
+            text(
+                "ALTER TABLE search_jobs "
+                "ADD COLUMN IF NOT EXISTS run_after "
+                "TIMESTAMPTZ DEFAULT now(), "
+                "ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ"
+            )
+        )
 
 
 async def get_db():
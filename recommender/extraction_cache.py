@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from recommender.database import async_session
+from recommender.models import ReviewExtraction
+from recommender.structured_data import AllReviewAnalysis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_TTL_HOURS = float(
+    os.getenv("EXTRACTION_CACHE_TTL_HOURS", "168")
+)
+
+
+def _comment_content(comments: List[Dict]) -> List:
+    """Keep only the content of a comment tree, dropping volatile counters"""
+    return [
+        [
+            comment.get("id"),
+            comment.get("body") or comment.get("text"),
+            _comment_content(comment.get("replies") or []),
+        ]
+        for comment in comments
+    ]
+
+
+def extraction_cache_key(
+    data: Dict[str, Any],
+    search_query: str,
+    source: str,
+    model: str,
+    prompt_version: str,
+) -> str:
+    """Content hash identifying one post's extraction result"""
+    payload = json.dumps(
+        [
+            source,
+            data["id"],
+            data.get("body"),
+            _comment_content(data.get("comments", [])),
+            search_query,
+            prompt_version,
+            model,
+        ],
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def get_cached_extractions(
+    cache_keys: List[str],
+) -> Dict[str, AllReviewAnalysis]:
+    """Look up unexpired extraction results for the given keys"""
+    if not cache_keys:
+        return {}
+
+    async with async_session() as db:
+        try:
+            result = await db.execute(
+                select(ReviewExtraction.cache_key, ReviewExtraction.result)
+                .filter(ReviewExtraction.cache_key.in_(cache_keys))
+                .filter(ReviewExtraction.expires_at > datetime.now(timezone.utc))
+            )
+            return {
+                cache_key: AllReviewAnalysis.model_validate(value)
+                for cache_key, value in result.all()
+            }
+        except Exception as e:
+            logger.error(f"Error reading extraction cache: {e}", exc_info=True)
+            return {}
+
+
+async def save_extractions(entries: List[Dict[str, Any]]):
+    """
+    Store extraction results.
+
+    Args:
+        entries: Dictionaries with cache_key, post_id, source, model,
+            prompt_version and the AllReviewAnalysis result
+    """
+    if not entries:
+        return
+
+    expires_at = datetime.now(timezone.utc) + timedelta(
+        hours=EXTRACTION_CACHE_TTL_HOURS
+    )
+    rows = {
+        entry["cache_key"]: {
+            **entry,
+            "result": entry["result"].model_dump(),
+            "expires_at": expires_at,
+        }
+        for entry in entries
+    }
+    statement = insert(ReviewExtraction).values(list(rows.values()))
+    statement = statement.on_conflict_do_update(
+        index_elements=[ReviewExtraction.cache_key],
+        set_={
+            "result": statement.excluded.result,
+            "expires_at": statement.excluded.expires_at,
+        },
+    )
+
+    async with async_session() as db:
+        try:
+            await db.execute(statement)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error saving extraction cache: {e}", exc_info=True)
+
+
+async def purge_expired_extractions():
+    """Delete expired extraction results"""
+    async with async_session() as db:
+        try:
+            result = await db.execute(
+                delete(ReviewExtraction).filter(
+                    ReviewExtraction.expires_at <= datetime.now(timezone.utc)
+                )
+            )
+            await db.commit()
+            logger.info(f"Purged {result.rowcount} expired extractions")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error purging extraction cache: {e}", exc_info=True)
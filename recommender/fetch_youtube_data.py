@@ -2,11 +2,14 @@ import asyncio
 import logging
 import os
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Dict, List, Optional
 
 import aiohttp
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from recommender.http_client import close_http_client, get_http_session
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -15,35 +18,53 @@ YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
 @asynccontextmanager
 async def get_youtube_session():
-    """Context manager for YouTube API session"""
-    async with aiohttp.ClientSession() as session:
-        try:
-            yield session
-        finally:
-            if not session.closed:
-                await session.close()
+    """Context manager for YouTube API session backed by the shared client"""
+    yield await get_http_session()
 
 
-async def get_transcript(video_id: str) -> Optional[str]:
+async def get_transcript_segments(video_id: str) -> Optional[List[Dict]]:
     """
-    Get video transcript.
+    Get video transcript as timed segments.
 
     Args:
         video_id: YouTube video ID
 
     Returns:
-        String containing the transcript or None if unavailable
+        List of segments with start time in seconds and text, or None if
+        unavailable
     """
     try:
         transcript = await asyncio.to_thread(
             YouTubeTranscriptApi.get_transcript, video_id
         )
-        return " ".join([entry["text"] for entry in transcript])
+        return [
+            {"start": round(entry["start"], 1), "text": entry["text"]}
+            for entry in transcript
+        ]
     except Exception as e:
         logger.error(f"Transcript error for video {video_id}: {str(e)}")
         return None
 
 
+def join_transcript(segments: Optional[List[Dict]]) -> Optional[str]:
+    if not segments:
+        return None
+    return " ".join([segment["text"] for segment in segments])
+
+
+async def get_transcript(video_id: str) -> Optional[str]:
+    """
+    Get video transcript.
+
+    Args:
+        video_id: YouTube video ID
+
+    Returns:
+        String containing the transcript or None if unavailable
+    """
+    return join_transcript(await get_transcript_segments(video_id))
+
+
 async def fetch_comment_replies(
     session: aiohttp.ClientSession, parent_id: str, max_replies: int = 5
 ) -> List[Dict]:
@@ -173,24 +194,75 @@ async def fetch_video_comments(
         return []
 
 
+async def fetch_video_statistics(
+    session: aiohttp.ClientSession, video_ids: List[str]
+) -> Dict[str, Dict]:
+    """
+    Fetch statistics for several videos in a single videos.list call.
+
+    Args:
+        session: Active aiohttp session
+        video_ids: YouTube video IDs (at most 50, the API page limit)
+
+    Returns:
+        Dictionary mapping video ID to its statistics
+    """
+    if not video_ids:
+        return {}
+
+    stats_url = (
+        "https://www.googleapis.com/youtube/v3/videos"
+        f"?part=statistics&id={','.join(video_ids)}"
+        f"&maxResults={len(video_ids)}&key={YOUTUBE_API_KEY}"
+    )
+
+    async with session.get(stats_url) as response:
+        if response.status != 200:
+            logger.error(
+                f"Stats error: {response.status} - {await response.text()}"
+            )
+            return {}
+
+        video_response = await response.json()
+
+    return {
+        item["id"]: item["statistics"]
+        for item in video_response.get("items", [])
+    }
+
+
 async def search_youtube_videos(
     query: str,
     max_results: int = 5,
     max_comments: int = 5,
     max_replies: int = 5,
+    concurrency: int = 5,
+    published_after: Optional[datetime] = None,
+    results: Optional[Dict[int, Dict]] = None,
 ) -> List[Dict]:
     """
     Search YouTube for videos and fetch their details.
 
+    Statistics for all hits are fetched in one batched call, then the
+    transcripts and comment threads of every video are fetched concurrently.
+
     Args:
         query: Search query string
         max_results: Maximum number of videos to return
         max_comments: Maximum number of comments per video
         max_replies: Maximum number of replies per comment
+        concurrency: Maximum number of in-flight transcript/comment fetches
+        published_after: Only return videos published after this naive UTC
+            time, newest first
+        results: Filled with each video, keyed by its search rank, as soon
+            as it is enriched, so that a caller cancelling the search keeps
+            the videos that completed
 
     Returns:
         List of video dictionaries with details
     """
+    if results is None:
+        results = {}
     async with get_youtube_session() as session:
         try:
             logger.info(f"Searching YouTube for: {query}")
@@ -201,6 +273,11 @@ async def search_youtube_videos(
                 f"?part=id,snippet&q={query}&type=video"
                 f"&maxResults={max_results}&key={YOUTUBE_API_KEY}"
             )
+            if published_after is not None:
+                search_url += (
+                    "&order=date&publishedAfter="
+                    f"{published_after.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+                )
 
             async with session.get(search_url) as response:
                 if response.status != 200:
@@ -211,73 +288,79 @@ async def search_youtube_videos(
 
                 search_response = await response.json()
 
-            videos = []
-            for search_result in search_response.get("items", []):
-                try:
-                    video_id = search_result["id"]["videoId"]
-                    video_info = search_result["snippet"]
+            search_results = [
+                item
+                for item in search_response.get("items", [])
+                if item.get("id", {}).get("videoId")
+            ]
+            statistics = await fetch_video_statistics(
+                session, [item["id"]["videoId"] for item in search_results]
+            )
 
-                    # Get video statistics
-                    stats_url = (
-                        "https://www.googleapis.com/youtube/v3/videos"
-                        f"?part=statistics&id={video_id}&key={YOUTUBE_API_KEY}"
-                    )
+            semaphore = asyncio.Semaphore(concurrency)
 
-                    async with session.get(stats_url) as response:
-                        if response.status != 200:
-                            logger.error(
-                                f"Stats error: {response.status} - {await response.text()}"
-                            )
-                            continue
+            async def bounded(coroutine):
+                async with semaphore:
+                    return await coroutine
 
-                        video_response = await response.json()
-
-                    if not video_response.get("items"):
+            async def enrich(rank: int, search_result: Dict):
+                video_id = search_result["id"]["videoId"]
+                video_info = search_result["snippet"]
+                try:
+                    if video_id not in statistics:
                         logger.error(
                             f"No statistics found for video {video_id}"
                         )
-                        continue
-
-                    video_data = video_response["items"][0]
-                    statistics = video_data["statistics"]
+                        return
 
-                    # Get transcript
-                    transcript_text = (
-                        await get_transcript(video_id)
-                        or "Transcript not available"
-                    )
-
-                    # Get comments
-                    comments = await fetch_video_comments(
-                        session, video_id, max_comments, max_replies
+                    segments, comments = await asyncio.gather(
+                        bounded(get_transcript_segments(video_id)),
+                        bounded(
+                            fetch_video_comments(
+                                session, video_id, max_comments, max_replies
+                            )
+                        ),
                     )
 
-                    videos.append(
-                        {
-                            "author": video_info["channelTitle"],
-                            "id": video_id,
-                            "title": video_info["title"],
-                            "description": video_info["description"],
-                            "views": statistics.get("viewCount"),
-                            "likes": statistics.get("likeCount"),
-                            "created_at": video_info["publishedAt"],
-                            "body": transcript_text,
-                            "comments": comments,
-                            "url": f"https://www.youtube.com/watch?v={video_id}",
-                        }
-                    )
-                    logger.info(f"Processed video: {videos[-1]['url']}")
+                    video = {
+                        "author": video_info["channelTitle"],
+                        "id": video_id,
+                        "title": video_info["title"],
+                        "description": video_info["description"],
+                        "views": statistics[video_id].get("viewCount"),
+                        "likes": statistics[video_id].get("likeCount"),
+                        "created_at": video_info["publishedAt"],
+                        "body": join_transcript(segments)
+                        or "Transcript not available",
+                        "transcript_segments": segments or [],
+                        "comments": comments,
+                        "url": f"https://www.youtube.com/watch?v={video_id}",
+                    }
+                    logger.info(f"Processed video: {video['url']}")
+                    results[rank] = video
 
                 except Exception as e:
                     logger.error(f"Error processing video {video_id}: {str(e)}")
-                    continue
 
-            return videos
+            await asyncio.gather(
+                *(
+                    enrich(rank, search_result)
+                    for rank, search_result in enumerate(search_results)
+                )
+            )
+            return [results[rank] for rank in sorted(results)]
 
         except Exception as e:
             logger.error(f"Error in YouTube search: {str(e)}")
             return []
 
 
+async def main():
+    try:
+        await search_youtube_videos("pixel phone reviews")
+    finally:
+        await close_http_client()
+
+
 if __name__ == "__main__":
-    asyncio.run(search_youtube_videos("pixel phone reviews"))
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import aiohttp
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", "30"))
+
+_session: Optional[aiohttp.ClientSession] = None
+_stats = {
+    "requests": 0,
+    "request_errors": 0,
+    "connections_created": 0,
+    "connections_reused": 0,
+    "dns_cache_hits": 0,
+    "dns_cache_misses": 0,
+}
+
+
+def _counter(name: str):
+    async def increment(session, context, params):
+        _stats[name] += 1
+
+    return increment
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_counter("requests"))
+    trace_config.on_request_exception.append(_counter("request_errors"))
+    trace_config.on_connection_create_end.append(
+        _counter("connections_created")
+    )
+    trace_config.on_connection_reuseconn.append(_counter("connections_reused"))
+    trace_config.on_dns_cache_hit.append(_counter("dns_cache_hits"))
+    trace_config.on_dns_cache_miss.append(_counter("dns_cache_misses"))
+    return trace_config
+
+
+async def start_http_client() -> aiohttp.ClientSession:
+    """Create the process-wide HTTP session shared by upstream callers"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT),
+            trace_configs=[_trace_config()],
+        )
+        logger.info("Started shared HTTP client")
+    return _session
+
+
+async def close_http_client():
+    """Close the shared HTTP session and its connection pool"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Closed shared HTTP client")
+    _session = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """
+    Get the shared HTTP session.
+
+    The session is normally created on application startup; it is created
+    lazily here so that scripts and background tasks can use it as well.
+    """
+    if _session is None or _session.closed:
+        return await start_http_client()
+    return _session
+
+
+def get_http_pool_stats() -> Dict:
+    """Get connection pool statistics for monitoring"""
+    stats = dict(_stats)
+    stats["running"] = _session is not None and not _session.closed
+    if stats["running"]:
+        connector = _session.connector
+        stats["limit"] = connector.limit
+        stats["limit_per_host"] = connector.limit_per_host
+        # aiohttp has no public accessors for pool occupancy
+        stats["active_connections"] = len(getattr(connector, "_acquired", ()))
+        stats["idle_connections"] = sum(
+            len(connections)
+            for connections in getattr(connector, "_conns", {}).values()
+        )
+    return stats
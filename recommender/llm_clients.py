@@ -0,0 +1,51 @@
+import logging
+from typing import Any, Dict, Optional, Tuple, Type
+
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_clients: Dict[Tuple[str, float, Optional[Type[BaseModel]]], Any] = {}
+_stats = {"built": 0, "reused": 0}
+
+
+def _get_or_build(key, build):
+    client = _clients.get(key)
+    if client is None:
+        client = build()
+        _clients[key] = client
+        _stats["built"] += 1
+        logger.info(f"Built LLM client for {key[0]} (schema={key[2]})")
+    else:
+        _stats["reused"] += 1
+    return client
+
+
+def get_chat_model(model: str, temperature: float) -> ChatOpenAI:
+    """Get a shared chat model client for the given settings"""
+    # Retries of rate limits and transient errors are owned by the LLM
+    # scheduler
+    return _get_or_build(
+        (model, temperature, None),
+        lambda: ChatOpenAI(
+            model=model, temperature=temperature, max_retries=0
+        ),
+    )
+
+
+def get_structured_model(
+    model: str, temperature: float, schema: Type[BaseModel]
+):
+    """Get a shared structured-output runnable for the given settings"""
+    return _get_or_build(
+        (model, temperature, schema),
+        lambda: get_chat_model(model, temperature).with_structured_output(
+            schema
+        ),
+    )
+
+
+def get_client_stats() -> Dict:
+    return {**_stats, "cached": len(_clients)}
@@ -0,0 +1,320 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import openai
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _parse_model_limits(value: str) -> Dict[str, int]:
+    """Parse "model=limit,model=limit" into a dictionary"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MODEL_CONCURRENCY = _parse_model_limits(
+    os.getenv("LLM_MODEL_CONCURRENCY", "gpt-4o=8,gpt-4o-mini=16")
+)
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+
+TOKEN_WINDOW_SECONDS = 60
+
+
+class Priority(IntEnum):
+    """Scheduling classes, lower values are admitted first"""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for budgeting, about four characters per token"""
+    return len(text) // 4 + 1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Server errors, request timeouts and dropped connections"""
+    # APITimeoutError is a subclass of APIConnectionError
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code == 408 or (
+        status_code is not None and status_code >= 500
+    )
+
+
+class SpendBudgetExceeded(Exception):
+    """Raised when a call would exceed the spend budget of its context"""
+
+
+class SpendMeter:
+    """Estimated LLM tokens spent by a unit of work, with an optional cap"""
+
+    def __init__(self, budget_tokens: Optional[int] = None):
+        self.budget_tokens = budget_tokens
+        self.spent_tokens = 0
+        self.calls = 0
+
+    @property
+    def remaining_tokens(self) -> Optional[int]:
+        if self.budget_tokens is None:
+            return None
+        return max(0, self.budget_tokens - self.spent_tokens)
+
+    def charge(self, tokens: int):
+        if (
+            self.budget_tokens is not None
+            and self.spent_tokens + tokens > self.budget_tokens
+        ):
+            raise SpendBudgetExceeded(
+                f"LLM spend budget of {self.budget_tokens} tokens exhausted"
+            )
+        self.spent_tokens += tokens
+        self.calls += 1
+
+
+_spend_meter: ContextVar[Optional[SpendMeter]] = ContextVar(
+    "llm_spend_meter", default=None
+)
+
+
+@contextmanager
+def spend_meter(budget_tokens: Optional[int] = None) -> Iterator[SpendMeter]:
+    """
+    Meter the LLM calls submitted in this context, including tasks created
+    from it. Calls that would exceed `budget_tokens` raise
+    SpendBudgetExceeded instead of being submitted.
+    """
+    meter = SpendMeter(budget_tokens)
+    token = _spend_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _spend_meter.reset(token)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read the Retry-After header from an OpenAI API error, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls.
+
+    Calls are admitted in priority order, subject to a global concurrency
+    limit, a per-model concurrency limit and a per-model token-per-minute
+    budget. Calls failing with HTTP 429, a server error, a timeout or a
+    dropped connection release their slot and are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = (
+            LLM_MODEL_CONCURRENCY
+            if model_concurrency is None
+            else model_concurrency
+        )
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._active = 0
+        self._active_by_model = defaultdict(int)
+        self._token_usage = defaultdict(deque)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {
+            "calls": 0,
+            "failures": 0,
+            "rate_limited": 0,
+            "transient_errors": 0,
+            "retries": 0,
+            "tokens_admitted": 0,
+        }
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_concurrency.get(model, self.max_concurrency)
+
+    def _tokens_in_window(self, model: str, now: float) -> int:
+        usage = self._token_usage[model]
+        while usage and usage[0][0] <= now - TOKEN_WINDOW_SECONDS:
+            usage.popleft()
+        return sum(tokens for _, tokens in usage)
+
+    def _dispatch(self):
+        """Admit queued calls in priority order while capacity allows"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        blocked_models = set()
+        deferred = []
+        wake_at = None
+
+        while self._queue and self._active < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            _, _, model, tokens, future = entry
+            if future.done():
+                continue
+
+            # Keep later calls for a blocked model behind the blocked one
+            if (
+                model in blocked_models
+                or self._active_by_model[model] >= self._model_limit(model)
+            ):
+                blocked_models.add(model)
+                deferred.append(entry)
+                continue
+
+            used = self._tokens_in_window(model, now)
+            if used and used + tokens > self.tokens_per_minute:
+                oldest = self._token_usage[model][0][0]
+                expires = oldest + TOKEN_WINDOW_SECONDS
+                wake_at = expires if wake_at is None else min(wake_at, expires)
+                blocked_models.add(model)
+                deferred.append(entry)
+                continue
+
+            self._active += 1
+            self._active_by_model[model] += 1
+            self._token_usage[model].append((now, tokens))
+            self.stats["tokens_admitted"] += tokens
+            future.set_result(None)
+
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+
+        if wake_at is not None:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = loop.call_at(wake_at, self._dispatch)
+
+    def _release(self, model: str):
+        self._active -= 1
+        self._active_by_model[model] -= 1
+        self._dispatch()
+
+    async def _acquire(self, model: str, tokens: int, priority: Priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queue,
+            (int(priority), next(self._sequence), model, tokens, future),
+        )
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after being admitted, give the slot back
+            if future.done() and not future.cancelled():
+                self._release(model)
+            raise
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.max_delay, self.base_delay * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    async def submit(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        model: str,
+        estimated_tokens: int = 0,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> Any:
+        """
+        Run an LLM call once the scheduler admits it.
+
+        Args:
+            call: Zero-argument callable returning the LLM coroutine
+            model: Model name used for per-model limits
+            estimated_tokens: Prompt plus expected completion tokens
+            priority: Scheduling class of the call
+
+        Returns:
+            The result of the call
+        """
+        meter = _spend_meter.get()
+        if meter is not None:
+            meter.charge(estimated_tokens)
+
+        attempt = 0
+        while True:
+            await self._acquire(model, estimated_tokens, priority)
+            self.stats["calls"] += 1
+            try:
+                return await call()
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                if (
+                    not (rate_limited or is_transient_error(e))
+                    or attempt >= self.max_retries
+                ):
+                    self.stats["failures"] += 1
+                    raise
+                if rate_limited:
+                    self.stats["rate_limited"] += 1
+                    reason = "Rate limited"
+                else:
+                    self.stats["transient_errors"] += 1
+                    reason = type(e).__name__
+                delay = self._backoff(attempt, e)
+            finally:
+                self._release(model)
+
+            attempt += 1
+            self.stats["retries"] += 1
+            logger.warning(
+                f"{reason} on {model}, retry {attempt} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "active": self._active,
+            "queued": sum(
+                1 for entry in self._queue if not entry[4].done()
+            ),
+        }
+
+
+llm_scheduler = LLMScheduler()
@@ -5,10 +5,12 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
     func,
+    text,
 )
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
@@ -26,6 +28,49 @@ class Posts(Base):
     raw_data = Column(JSONB)
 
 
+class ReviewExtraction(Base):
+    __tablename__ = "review_extractions"
+
+    cache_key = Column(String, primary_key=True)
+    post_id = Column(String, index=True)
+    source = Column(String)
+    model = Column(String)
+    prompt_version = Column(String)
+    result = Column(JSONB)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), index=True)
+
+
+class SearchJob(Base):
+    __tablename__ = "search_jobs"
+
+    id = Column(String, primary_key=True)
+    search_query = Column(String, index=True)
+    status = Column(String, index=True, default="queued")
+    params = Column(JSONB, default={})
+    attempts = Column(Integer, default=0)
+    result = Column(JSONB)
+    error = Column(Text)
+    # Queued jobs are not claimed before this time, to back off retries
+    run_after = Column(DateTime(timezone=True), server_default=func.now())
+    # Updated periodically by the worker running the job
+    heartbeat_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    __table_args__ = (
+        # At most one active job per query
+        Index(
+            "uq_search_jobs_active_query",
+            "search_query",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+
 class StructuredOutput(Base):
     __tablename__ = "structured_outputs"
     id = Column(Integer, primary_key=True)
@@ -83,6 +128,7 @@ class SearchHistory(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     search_query = Column(String, index=True)
+    raw_search_query = Column(String)
     searched_at = Column(DateTime(timezone=True), server_default=func.now())
     structured_output_id = Column(Integer, ForeignKey("structured_outputs.id"))
     # Relationship with User
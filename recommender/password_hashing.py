@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hashes running at once; further logins wait without holding a thread
+PASSWORD_HASH_CONCURRENCY = int(
+    os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS))
+)
+
+# Hashes made with a different cost factor need an update, so changing
+# BCRYPT_ROUNDS rehashes each password at its next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded thread pool so that hashing does not block
+    the event loop. At most `concurrency` hashes run at a time, which caps
+    the CPU spent on login bursts.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        concurrency: int = PASSWORD_HASH_CONCURRENCY,
+        context: CryptContext = pwd_context,
+    ):
+        self.context = context
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"hashes": 0, "verifications": 0, "rehashes": 0}
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(func, *args)
+            )
+
+    async def hash(self, password: str) -> str:
+        self.stats["hashes"] += 1
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        self.stats["verifications"] += 1
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(
+        self, password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password and rehash it if its hash is outdated.
+
+        Returns:
+            Whether the password is valid, and the new hash to store if the
+            hash needs an update
+        """
+        self.stats["verifications"] += 1
+        valid, new_hash = await self._run(
+            self.context.verify_and_update, password, hashed_password
+        )
+        if new_hash:
+            self.stats["rehashes"] += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "rounds": BCRYPT_ROUNDS}
+
+
+password_hasher = PasswordHasher()
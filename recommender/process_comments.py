@@ -1,7 +1,17 @@
+import heapq
+import itertools
+import os
+import time
 from datetime import datetime
 
 from asyncpraw.models import Comment
 
+# Comments kept per thread; prompts only ever use the best few dozen
+COMMENT_BUDGET = int(os.getenv("COMMENT_BUDGET", "100"))
+COMMENT_TIME_BUDGET_SECONDS = float(
+    os.getenv("COMMENT_TIME_BUDGET_SECONDS", "5")
+)
+
 
 async def process_comments(
     comment_forest,
@@ -10,49 +20,71 @@ async def process_comments(
     score_threshold=10,
     min_length=50,
     recent_days=None,
+    max_comments=COMMENT_BUDGET,
+    time_budget=COMMENT_TIME_BUDGET_SECONDS,
 ):
-    if depth >= max_depth:
-        return []
+    """
+    Harvest the best comments of a thread, highest score first.
 
-    processed_comments = []
+    Comments wait in a priority queue ordered by score; the replies of a
+    comment are only read once the comment itself is kept, so the highest
+    scoring branches are expanded first. Harvesting stops once
+    `max_comments` comments are kept, `time_budget` seconds have passed
+    or no remaining comment can pass the score threshold.
+
+    Returns:
+        Kept comments with their kept replies nested under "replies",
+        each level sorted by score
+    """
     current_time = datetime.now()
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    sequence = itertools.count()
+    frontier = []
+    processed_comments = []
+    kept = 0
 
-    async for comment in comment_forest:
-        if isinstance(comment, Comment):
-            comment_data = {
-                "author": comment.author.name
-                if comment.author
-                else "[deleted]",
-                "id": comment.id,
-                "body": comment.body,
-                "score": comment.score,
-                "created": comment.created,
-                "url": f"https://www.reddit.com{comment.permalink}",
-                "replies": [],
-            }
-
-            comment_date = datetime.fromtimestamp(comment.created_utc)
-
-            if (
-                comment.score >= score_threshold
-                and len(comment.body) >= min_length
-                and (
-                    not recent_days
-                    or (current_time - comment_date).days <= recent_days
-                )
-            ):
-                comment_data["replies"] = await process_comments(
-                    comment.replies,
-                    depth + 1,
-                    max_depth,
-                    score_threshold,
-                    min_length,
-                    recent_days,
+    async def enqueue(forest, level, siblings):
+        if level >= max_depth:
+            return
+        async for comment in forest:
+            if isinstance(comment, Comment):
+                heapq.heappush(
+                    frontier,
+                    (-comment.score, next(sequence), comment, level, siblings),
                 )
-                processed_comments.append(comment_data)
 
-    return sorted(
-        processed_comments,
-        key=lambda x: x["score"],
-        reverse=True,
-    )
+    await enqueue(comment_forest, depth, processed_comments)
+
+    while frontier:
+        if max_comments is not None and kept >= max_comments:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+        _, _, comment, level, siblings = heapq.heappop(frontier)
+        # Replies are only queued under kept comments, so nothing left in
+        # the queue can reach the threshold either
+        if comment.score < score_threshold:
+            break
+
+        comment_date = datetime.fromtimestamp(comment.created_utc)
+        if len(comment.body) < min_length or (
+            recent_days and (current_time - comment_date).days > recent_days
+        ):
+            continue
+
+        comment_data = {
+            "author": comment.author.name if comment.author else "[deleted]",
+            "id": comment.id,
+            "body": comment.body,
+            "score": comment.score,
+            "created": comment.created,
+            "url": f"https://www.reddit.com{comment.permalink}",
+            "replies": [],
+        }
+        siblings.append(comment_data)
+        kept += 1
+        await enqueue(comment.replies, level + 1, comment_data["replies"])
+
+    # Comments are kept in score order, so every level is already sorted
+    return processed_comments
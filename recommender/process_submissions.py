@@ -1,9 +1,14 @@
+import math
 from datetime import datetime
 from typing import List
 
 from asyncpraw.models import Submission
 
-from recommender.process_comments import process_comments
+from recommender.process_comments import (
+    COMMENT_BUDGET,
+    COMMENT_TIME_BUDGET_SECONDS,
+    process_comments,
+)
 
 
 async def process_submissions(
@@ -36,12 +41,34 @@ async def process_submissions(
     return processed_submissions
 
 
+async def rank_submissions(
+    submissions: List[Submission],
+    score_threshold: int = 10,
+    min_length: int = 50,
+    recent_days: int | None = None,
+) -> List[Submission]:
+    """
+    Filter submissions like process_submissions and order them by score
+    and body length, both on a log scale so neither dominates.
+    """
+    candidates = await process_submissions(
+        submissions, score_threshold, min_length, recent_days
+    )
+    return sorted(
+        candidates,
+        key=lambda x: math.log1p(max(x.score, 0)) + math.log1p(len(x.selftext)),
+        reverse=True,
+    )
+
+
 async def process_submission(
     submission,
     score_threshold=10,
     min_length=50,
     recent_days=None,
     max_comment_depth=3,
+    max_comments=COMMENT_BUDGET,
+    comment_time_budget=COMMENT_TIME_BUDGET_SECONDS,
 ):
     # load the submission to ensure that the comments are available
     await submission.load()
@@ -52,6 +79,8 @@ async def process_submission(
         score_threshold=score_threshold,
         min_length=min_length,
         recent_days=recent_days,
+        max_comments=max_comments,
+        time_budget=comment_time_budget,
     )
 
     return {
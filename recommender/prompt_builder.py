@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import html
+import logging
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POST_TOKEN_BUDGET = int(os.getenv("POST_TOKEN_BUDGET", "3000"))
+# Share of the post budget the body may use when comments compete for it
+BODY_BUDGET_SHARE = 0.6
+
+TAG_PATTERN = re.compile(r"<br\s*/?>|</p>", re.IGNORECASE)
+HTML_PATTERN = re.compile(r"<[^>]+>")
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+# Caption noise such as [Music], [Applause] or [Laughter]
+CAPTION_PATTERN = re.compile(r"\[(?:music|applause|laughter|__)\]", re.I)
+WHITESPACE_PATTERN = re.compile(r"[ \t\r\f\v]+")
+NEWLINES_PATTERN = re.compile(r"\n\s*\n+")
+
+# Set to _UNAVAILABLE when loading fails, so the load is not retried
+_UNAVAILABLE = object()
+_encoding = None
+_stats = {"posts": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = _UNAVAILABLE
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning(
+                    f"Tokenizer unavailable, estimating tokens: {e}"
+                )
+    return None if _encoding is _UNAVAILABLE else _encoding
+
+
+async def preload_encoding():
+    """Load the tokenizer off the event loop, it may download its ranks"""
+    await asyncio.to_thread(_get_encoding)
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars] + " …"
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + " …"
+
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """Split text into consecutive pieces of at most max_tokens tokens"""
+    encoding = _get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * 4
+        return [
+            text[i : i + max_chars] for i in range(0, len(text), max_chars)
+        ]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[i : i + max_tokens])
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+def clean_text(text: Any) -> str:
+    """Strip HTML, URLs and caption noise and collapse whitespace"""
+    if not text:
+        return ""
+    text = html.unescape(str(text))
+    text = TAG_PATTERN.sub("\n", text)
+    text = HTML_PATTERN.sub("", text)
+    text = URL_PATTERN.sub("", text)
+    text = CAPTION_PATTERN.sub("", text)
+    text = WHITESPACE_PATTERN.sub(" ", text)
+    text = NEWLINES_PATTERN.sub("\n", text)
+    return text.strip()
+
+
+def _comment_score(comment: Dict) -> int:
+    return comment.get("score", comment.get("likes")) or 0
+
+
+def _comment_line(comment: Dict, depth: int) -> str:
+    text = clean_text(comment.get("body") or comment.get("text"))
+    if not text:
+        return ""
+    return (
+        f"{'  ' * depth}- {comment.get('id')} "
+        f"[{_comment_score(comment)}] {text}"
+    )
+
+
+def compact_comments(
+    comments: List[Dict], max_tokens: int
+) -> Tuple[str, int]:
+    """
+    Render a comment tree as indented lines within a token budget.
+
+    Comments are selected highest score first; a reply becomes eligible
+    once its parent has been selected. The selection is rendered in tree
+    order so the model still sees who replied to whom.
+
+    Returns:
+        The rendered comments and the number of comments kept
+    """
+    frontier = []
+    sequence = 0
+    for comment in comments:
+        heapq.heappush(
+            frontier, (-_comment_score(comment), sequence, comment, 0, ())
+        )
+        sequence += 1
+
+    selected = {}
+    used = 0
+    while frontier:
+        _, position, comment, depth, path = heapq.heappop(frontier)
+        line = _comment_line(comment, depth)
+        if not line:
+            continue
+        tokens = count_tokens(line) + 1
+        if used + tokens > max_tokens:
+            continue
+        used += tokens
+        node_path = path + (position,)
+        selected[node_path] = line
+        for reply in comment.get("replies") or []:
+            entry = (-_comment_score(reply), sequence, reply, depth + 1)
+            heapq.heappush(frontier, entry + (node_path,))
+            sequence += 1
+
+    # Tuple ordering of the paths yields parents before their replies
+    lines = [selected[node_path] for node_path in sorted(selected)]
+    return "\n".join(lines), len(lines)
+
+
+def build_post_context(
+    data: Dict[str, Any],
+    token_budget: int = POST_TOKEN_BUDGET,
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Serialize a post into the compact form used in extraction prompts.
+
+    Only the post id, url and title, the cleaned body and the cleaned
+    comment text with ids and scores are kept. When body and comments
+    compete for the token budget the body is guaranteed its share and the
+    comments get the rest; whichever needs less leaves the remainder to
+    the other.
+
+    Returns:
+        The post context and token statistics for it
+    """
+    title = clean_text(data.get("title"))
+    body = clean_text(data.get("body"))
+    comments = data.get("comments") or []
+
+    available = token_budget - count_tokens(title)
+    body_reserve = min(
+        count_tokens(body), int(available * BODY_BUDGET_SHARE)
+    )
+    rendered_comments, kept = compact_comments(
+        comments, available - body_reserve
+    )
+    body = truncate_to_tokens(
+        body, available - count_tokens(rendered_comments)
+    )
+
+    context = f"""
+    post_id: {data['id']}
+    url: {data.get('url', '')}
+    title: {title}
+    post: {body}
+    comments (comment id, score in brackets, replies indented):
+{rendered_comments}"""
+
+    original = f"""
+    post_id: {data['id']}
+    post: {data.get('body')}
+    comments: {comments}"""
+
+    stats = {
+        "tokens_before": count_tokens(original),
+        "tokens_after": count_tokens(context),
+        "comments_kept": kept,
+    }
+    return context, stats
+
+
+def record_prompt_stats(post_id: str, stats: Dict[str, int]):
+    """Log and accumulate the tokens saved by compaction for one post"""
+    _stats["posts"] += 1
+    _stats["tokens_before"] += stats["tokens_before"]
+    _stats["tokens_after"] += stats["tokens_after"]
+    logger.info(
+        f"Prompt for post {post_id}: {stats['tokens_after']} tokens, "
+        f"saved {stats['tokens_before'] - stats['tokens_after']}"
+    )
+
+
+def get_prompt_stats() -> Dict[str, int]:
+    return {
+        **_stats,
+        "tokens_saved": _stats["tokens_before"] - _stats["tokens_after"],
+    }
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import asyncpraw
+from asyncprawcore import Requestor
+
+from recommender.environment_vars import (
+    CLIENT_ID,
+    CLIENT_SECRET,
+    REDIRECT_URI,
+    USER_AGENT,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDDIT_POOL_SIZE = int(os.getenv("REDDIT_POOL_SIZE", "100"))
+REDDIT_CLIENT_IDLE_SECONDS = float(
+    os.getenv("REDDIT_CLIENT_IDLE_SECONDS", "900")
+)
+REDDIT_POOL_SWEEP_SECONDS = float(
+    os.getenv("REDDIT_POOL_SWEEP_SECONDS", "60")
+)
+
+ACCESS_TOKEN_PATH = "/api/v1/access_token"
+APP_ONLY_KEY = "app-only"
+
+_token_refreshes = 0
+
+
+class CountingRequestor(Requestor):
+    """Requestor counting OAuth access token requests"""
+
+    def request(self, *args, **kwargs):
+        # Not a coroutine: asyncprawcore 2 awaits what request returns,
+        # asyncprawcore 4 enters it as an async context manager
+        global _token_refreshes
+        url = kwargs.get("url", args[1] if len(args) > 1 else "")
+        if str(url).endswith(ACCESS_TOKEN_PATH):
+            _token_refreshes += 1
+        return super().request(*args, **kwargs)
+
+
+class RedditClientPool:
+    """
+    Pool of long-lived asyncpraw clients.
+
+    Clients are keyed by refresh token, plus one app-only client. A reused
+    client keeps its access token until it expires, so the OAuth exchange
+    only happens on first use and expiry. Clients idle for longer than
+    `idle_seconds`, or beyond `max_clients`, are closed; a client evicted
+    while leased is closed when its last lease ends.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = REDDIT_POOL_SIZE,
+        idle_seconds: float = REDDIT_CLIENT_IDLE_SECONDS,
+        sweep_seconds: float = REDDIT_POOL_SWEEP_SECONDS,
+    ):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self.sweep_seconds = sweep_seconds
+        self._clients: OrderedDict[str, Tuple[asyncpraw.Reddit, float]] = (
+            OrderedDict()
+        )
+        # Leases per client id, and evicted clients waiting for theirs to end
+        self._leases: Dict[int, int] = {}
+        self._retired: Dict[int, asyncpraw.Reddit] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.stats = {"built": 0, "reused": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(refresh_token: Optional[str]) -> str:
+        if refresh_token is None:
+            return APP_ONLY_KEY
+        return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    def _build(self, refresh_token: Optional[str]) -> asyncpraw.Reddit:
+        return asyncpraw.Reddit(
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET,
+            user_agent=USER_AGENT,
+            redirect_uri=REDIRECT_URI,
+            refresh_token=refresh_token,
+            requestor_class=CountingRequestor,
+        )
+
+    @asynccontextmanager
+    async def acquire(
+        self, refresh_token: Optional[str] = None
+    ) -> AsyncIterator[asyncpraw.Reddit]:
+        """
+        Lease the client for a refresh token, or the app-only client when
+        None. Pooled clients are shared and must not be closed by callers.
+        """
+        reddit = self._checkout(refresh_token)
+        try:
+            while len(self._clients) > self.max_clients:
+                await self._evict(next(iter(self._clients)))
+            yield reddit
+        finally:
+            await self._release(reddit)
+
+    def _checkout(self, refresh_token: Optional[str]) -> asyncpraw.Reddit:
+        key = self._key(refresh_token)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.stats["reused"] += 1
+            reddit = entry[0]
+        else:
+            self.stats["built"] += 1
+            reddit = self._build(refresh_token)
+        self._clients[key] = (reddit, time.monotonic())
+        self._clients.move_to_end(key)
+        self._leases[id(reddit)] = self._leases.get(id(reddit), 0) + 1
+        return reddit
+
+    async def evict(self, refresh_token: Optional[str]):
+        """Close the client of a refresh token, e.g. when it is revoked"""
+        await self._evict(self._key(refresh_token))
+
+    async def _release(self, reddit: asyncpraw.Reddit):
+        leases = self._leases.pop(id(reddit)) - 1
+        if leases:
+            self._leases[id(reddit)] = leases
+        elif id(reddit) in self._retired:
+            del self._retired[id(reddit)]
+            await self._close(reddit)
+
+    async def _evict(self, key: str):
+        entry = self._clients.pop(key, None)
+        if entry is None:
+            return
+        self.stats["evicted"] += 1
+        reddit = entry[0]
+        if id(reddit) in self._leases:
+            # Closed by _release once the searches using it finish
+            self._retired[id(reddit)] = reddit
+        else:
+            await self._close(reddit)
+
+    async def _close(self, reddit: asyncpraw.Reddit):
+        try:
+            await reddit.close()
+        except Exception as e:
+            logger.error(f"Error closing Reddit client: {str(e)}")
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            cutoff = time.monotonic() - self.idle_seconds
+            idle = [
+                key
+                for key, (_, last_used) in self._clients.items()
+                if last_used < cutoff
+            ]
+            for key in idle:
+                await self._evict(key)
+            if idle:
+                logger.info(f"Closed {len(idle)} idle Reddit clients")
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for key in list(self._clients):
+            await self._evict(key)
+        for reddit in list(self._retired.values()):
+            await self._close(reddit)
+        self._retired.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            "size": len(self._clients),
+            "leased": len(self._leases),
+            "retired": len(self._retired),
+            "token_refreshes": _token_refreshes,
+        }
+
+
+reddit_client_pool = RedditClientPool()
@@ -1,9 +1,11 @@
 import logging
 import secrets
-from typing import Tuple
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Tuple
 
 import asyncpraw
 from fastapi import HTTPException
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from recommender.environment_vars import (
@@ -13,6 +15,7 @@ from recommender.environment_vars import (
     USER_AGENT,
 )
 from recommender.models import User
+from recommender.reddit_client_pool import reddit_client_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,6 +31,10 @@ class RedditService:
         refresh_token: str | None = None,
         redirect_uri: str | None = None,
     ):
+        """
+        New unpooled client, for the OAuth flow which changes the client's
+        credentials. Callers close it when done.
+        """
         return asyncpraw.Reddit(
             client_id=CLIENT_ID,
             client_secret=CLIENT_SECRET,
@@ -46,7 +53,10 @@ class RedditService:
         user.reddit_state = state
         await self.db.commit()
 
-        auth_url = reddit.auth.url(["identity", "read"], state, "permanent")
+        try:
+            auth_url = reddit.auth.url(["identity", "read"], state, "permanent")
+        finally:
+            await reddit.close()
         return str(auth_url), state
 
     async def handle_callback(self, code: str, state: str, user: User) -> bool:
@@ -68,10 +78,10 @@ class RedditService:
                 None  # clear the state after successful authentication
             )
             # get authenticated user and reddit username
-            reddit_client = await self.get_reddit_client(
-                refresh_token=refresh_token
-            )
-            reddit_user = await reddit_client.user.me()
+            async with reddit_client_pool.acquire(
+                refresh_token
+            ) as reddit_client:
+                reddit_user = await reddit_client.user.me()
             user.reddit_username = reddit_user.name
             await self.db.commit()
             return True
@@ -80,22 +90,36 @@ class RedditService:
             logger.error(f"Reddit Authentication failed: {str(e)}")
             await self.db.rollback()
             raise HTTPException(status_code=500, detail=str(e))
-
-    async def get_authorized_client(self, user: User):
-        """Get Reddit client with user's refresh token"""
-        reddit_client = await self.get_reddit_client()
+        finally:
+            await reddit.close()
+
+    @asynccontextmanager
+    async def authorized_client(
+        self, user
+    ) -> AsyncIterator[asyncpraw.Reddit]:
+        """
+        Lease the pooled Reddit client for the user's refresh token, or the
+        app-only client. Accepts a User or an authentication principal.
+        """
+        refresh_token = None
         if not user.has_reddit_refresh_token:
             logger.warning(
                 f"User {user.username} does not have a refresh token"
             )
-            return reddit_client
-
-        try:
-            reddit_client = await self.get_reddit_client(
-                refresh_token=user.reddit_refresh_token,
-            )
-            return reddit_client
-
-        except Exception as e:
-            logger.error(f"Failed to authorize user {user.username}: {str(e)}")
-            return await self.get_reddit_client()
+        else:
+            try:
+                refresh_token = getattr(user, "reddit_refresh_token", None)
+                if refresh_token is None:
+                    result = await self.db.execute(
+                        select(User.reddit_refresh_token).filter(
+                            User.id == user.id
+                        )
+                    )
+                    refresh_token = result.scalar()
+            except Exception as e:
+                logger.error(
+                    f"Failed to authorize user {user.username}: {str(e)}"
+                )
+
+        async with reddit_client_pool.acquire(refresh_token) as reddit:
+            yield reddit
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text, update
+
+from recommender.database import async_session, dedicated_engine
+from recommender.models import StructuredOutput
+from recommender.save_data import load_structured_output_entry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+# Results younger than the TTL are served as is; older results are served
+# for up to the stale window while a refresh runs in the background, and
+# recomputed before answering after that
+RESULT_CACHE_TTL_SECONDS = float(
+    os.getenv("RESULT_CACHE_TTL_SECONDS", "21600")
+)
+RESULT_CACHE_STALE_SECONDS = float(
+    os.getenv("RESULT_CACHE_STALE_SECONDS", "604800")
+)
+# Postgres channel telling every process which queries were invalidated
+RESULT_CACHE_CHANNEL = "result_cache_invalidations"
+RESULT_CACHE_LISTEN_RETRY_SECONDS = float(
+    os.getenv("RESULT_CACHE_LISTEN_RETRY_SECONDS", "5")
+)
+
+Revalidate = Callable[[], Awaitable[Any]]
+
+
+class ResultCache:
+    """
+    Two-tier cache of search results.
+
+    The first tier is an in-process LRU holding filtered results with the
+    time they were computed. Misses read through to the structured_outputs
+    and reviews tables and populate the LRU. Fresh entries are returned
+    directly; stale entries are returned while `revalidate` recomputes
+    them in the background, at most once per query at a time.
+
+    Invalidations are broadcast with Postgres NOTIFY, and every process
+    listening drops the query from its LRU. A process that loses its
+    listening connection clears its LRU, since it may have missed some.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        stale_seconds: float = RESULT_CACHE_STALE_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: OrderedDict[str, Tuple[Dict, float]] = OrderedDict()
+        self._revalidating: Dict[str, asyncio.Task] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self.stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "revalidations": 0,
+            "revalidation_errors": 0,
+            "invalidations": 0,
+            "remote_invalidations": 0,
+        }
+
+    def _age(self, computed_at: float) -> float:
+        return time.time() - computed_at
+
+    def set(
+        self, query: str, result: Dict, computed_at: Optional[float] = None
+    ):
+        self._entries[query] = (result, computed_at or time.time())
+        self._entries.move_to_end(query)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _expired(self, computed_at: float) -> bool:
+        return self._age(computed_at) > self.ttl_seconds + self.stale_seconds
+
+    def _get_memory(self, query: str) -> Optional[Tuple[Dict, float]]:
+        entry = self._entries.get(query)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            del self._entries[query]
+            return None
+        self._entries.move_to_end(query)
+        return entry
+
+    async def _get_db(self, query: str, db) -> Optional[Tuple[Dict, float]]:
+        if db is None:
+            async with async_session() as session:
+                return await self._get_db(query, session)
+        loaded = await load_structured_output_entry(query, db)
+        if loaded is None:
+            return None
+        structured_output, updated_at = loaded
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return structured_output, updated_at.timestamp()
+
+    async def get(
+        self,
+        query: str,
+        db=None,
+        revalidate: Optional[Revalidate] = None,
+        transform: Callable[[Dict], Dict] = lambda result: result,
+    ) -> Optional[Dict]:
+        """
+        Look up the result for a query.
+
+        Args:
+            query: Normalized search query
+            db: Session used for the database tier, a new one when None
+            revalidate: Coroutine function recomputing and storing the
+                result; stale entries are only served when given
+            transform: Applied to results loaded from the database before
+                they are cached in memory
+
+        Returns:
+            The cached result, or None when the caller must compute it
+        """
+        entry = self._get_memory(query)
+        if entry is not None:
+            tier = "memory_hits"
+        else:
+            try:
+                entry = await self._get_db(query, db)
+            except Exception as e:
+                logger.error(f"Result cache lookup error for '{query}': {e}")
+                entry = None
+            if entry is not None and not self._expired(entry[1]):
+                tier = "db_hits"
+                entry = (transform(entry[0]), entry[1])
+                self.set(query, *entry)
+            else:
+                entry = None
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        result, computed_at = entry
+        age = self._age(computed_at)
+        if age <= self.ttl_seconds:
+            self.stats[tier] += 1
+            return result
+        if revalidate is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["stale_hits"] += 1
+        self._start_revalidation(query, revalidate)
+        return result
+
+    def _start_revalidation(self, query: str, revalidate: Revalidate):
+        if query in self._revalidating:
+            return
+        self.stats["revalidations"] += 1
+        logger.info(f"Revalidating stale result for '{query}'")
+        task = asyncio.create_task(self._revalidate(query, revalidate))
+        self._revalidating[query] = task
+
+    async def _revalidate(self, query: str, revalidate: Revalidate):
+        try:
+            await revalidate()
+        except Exception as e:
+            self.stats["revalidation_errors"] += 1
+            logger.error(f"Revalidation error for '{query}': {str(e)}")
+        finally:
+            self._revalidating.pop(query, None)
+
+    async def invalidate(self, query: str) -> bool:
+        """
+        Expire the stored result of a query and drop it from the memory of
+        every process, so the next search recomputes it. The stored row is
+        kept for search history.
+
+        Returns:
+            Whether a stored result existed
+        """
+        self.stats["invalidations"] += 1
+        self._entries.pop(query, None)
+        async with async_session() as db:
+            result = await db.execute(
+                update(StructuredOutput)
+                .filter(StructuredOutput.search_query == query)
+                .values(updated_at=datetime.fromtimestamp(0, timezone.utc))
+            )
+            # Delivered to the listeners when the transaction commits
+            await db.execute(
+                text("SELECT pg_notify(:channel, :query)"),
+                {"channel": RESULT_CACHE_CHANNEL, "query": query},
+            )
+            await db.commit()
+        return result.rowcount > 0
+
+    def _on_invalidation(self, connection, pid, channel, query):
+        self.stats["remote_invalidations"] += 1
+        self._entries.pop(query, None)
+
+    async def _listen(self):
+        while True:
+            try:
+                async with dedicated_engine.connect() as connection:
+                    raw_connection = await connection.get_raw_connection()
+                    driver_connection = raw_connection.driver_connection
+                    closed = asyncio.Event()
+                    driver_connection.add_termination_listener(
+                        lambda _: closed.set()
+                    )
+                    await driver_connection.add_listener(
+                        RESULT_CACHE_CHANNEL, self._on_invalidation
+                    )
+                    logger.info("Listening for result cache invalidations")
+                    await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Result cache listener error: {str(e)}")
+            # Invalidations may have been missed while not listening
+            self._entries.clear()
+            await asyncio.sleep(RESULT_CACHE_LISTEN_RETRY_SECONDS)
+
+    def start(self):
+        """Start listening for invalidations made by other processes"""
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "revalidating": len(self._revalidating),
+        }
+
+
+result_cache = ResultCache()
@@ -1,8 +1,11 @@
+import json
 import logging
+import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
-from sqlalchemy import func, select
+from sqlalchemy import delete, func, literal_column, select, text, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from recommender.database import engine
@@ -11,45 +14,166 @@ from recommender.models import Base, Posts, Review, StructuredOutput
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT statement, well below the 32767 bind parameter limit
+POSTS_INSERT_CHUNK = int(os.getenv("POSTS_INSERT_CHUNK", "1000"))
+# Batches at least this large are loaded through a COPY staging table
+POSTS_COPY_THRESHOLD = int(os.getenv("POSTS_COPY_THRESHOLD", "5000"))
+# Collected fields only needed while analyzing, left out of Posts.raw_data;
+# the timed transcript segments duplicate the transcript in the body
+UNSTORED_FIELDS = {"transcript_segments"}
+
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
 
-async def save_data(all_submissions: dict, db: AsyncSession):
+async def save_data(
+    all_submissions: dict, db: AsyncSession, commit: bool = True
+) -> Dict[str, int]:
+    """
+    Upsert collected posts in one transaction.
+
+    With `commit` false the posts are only flushed, and are committed with
+    whatever the caller writes next in the same transaction.
+
+    Returns:
+        Counts of posts inserted, updated and skipped as unchanged
+    """
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
     try:
         for search_query, submissions_list in all_submissions.items():
-            result = await db.execute(
-                select(func.max(Posts.created_at)).filter(
-                    func.lower(Posts.search_query) == func.lower(search_query)
-                )
-            )
-            latest_submissions = result.scalar()
-
             for submission_dict in submissions_list:
-                await save_submissions(
-                    db,
-                    search_query,
-                    submission_dict["reddit"],
-                    "reddit",
-                    latest_submissions,
-                )
-                await save_submissions(
-                    db,
-                    search_query,
-                    submission_dict["youtube"],
-                    "youtube",
-                    latest_submissions,
-                )
+                for source in ["reddit", "youtube"]:
+                    saved = await save_submissions(
+                        db,
+                        search_query,
+                        submission_dict[source],
+                        source,
+                    )
+                    for key, value in saved.items():
+                        counts[key] += value
+
+        if not commit:
+            await db.flush()
+            return counts
 
         logger.info("Committing changes to database")
         await db.commit()
         logger.info(
-            f"Successfully saved submissions for queries: {list(all_submissions.keys())}"
+            f"Successfully saved submissions for queries: {list(all_submissions.keys())} {counts}"
         )
     except Exception as e:
         await db.rollback()
         logger.error(f"Error saving data: {e}", exc_info=True)
+    return counts
+
+
+async def get_latest_submission(
+    search_query: str, db: AsyncSession
+) -> Optional[datetime]:
+    """Creation time of the newest post stored for a query"""
+    result = await db.execute(
+        select(func.max(Posts.created_at)).filter(
+            func.lower(Posts.search_query) == func.lower(search_query)
+        )
+    )
+    return result.scalar()
+
+
+def submission_created_at(submission: Dict, source: str) -> datetime:
+    """Creation time of a collected post, as naive UTC like Posts.created_at"""
+    if source == "reddit":
+        return datetime.utcfromtimestamp(submission["created"])
+    return datetime.strptime(submission["created_at"], "%Y-%m-%dT%H:%M:%SZ")
+
+
+def _post_rows(
+    search_query: str, submissions: List[Dict], source: str
+) -> List[Dict]:
+    """Posts table rows for the submissions, the last one winning per id"""
+    rows = {}
+    for submission in submissions:
+        rows[submission["id"]] = {
+            "id": submission["id"],
+            "source": source,
+            "search_query": search_query,
+            "created_at": submission_created_at(submission, source),
+            "raw_data": {
+                key: value
+                for key, value in submission.items()
+                if key not in UNSTORED_FIELDS
+            },
+        }
+    return list(rows.values())
+
+
+def _count_upserted(inserted_flags: List[bool], total: int) -> Dict[str, int]:
+    inserted = sum(1 for flag in inserted_flags if flag)
+    return {
+        "inserted": inserted,
+        "updated": len(inserted_flags) - inserted,
+        "skipped": total - len(inserted_flags),
+    }
+
+
+async def _upsert_posts(db: AsyncSession, rows: List[Dict]) -> Dict[str, int]:
+    """Multi-row INSERT ... ON CONFLICT in chunks of POSTS_INSERT_CHUNK"""
+    flags = []
+    for i in range(0, len(rows), POSTS_INSERT_CHUNK):
+        statement = insert(Posts).values(rows[i : i + POSTS_INSERT_CHUNK])
+        statement = statement.on_conflict_do_update(
+            index_elements=[Posts.id],
+            # Posts keep the query that first found them
+            set_={
+                "created_at": statement.excluded.created_at,
+                "raw_data": statement.excluded.raw_data,
+            },
+            where=Posts.raw_data.is_distinct_from(statement.excluded.raw_data),
+        ).returning(literal_column("xmax = 0"))
+        result = await db.execute(statement)
+        flags.extend(result.scalars().all())
+    return _count_upserted(flags, len(rows))
+
+
+async def _copy_posts(db: AsyncSession, rows: List[Dict]) -> Dict[str, int]:
+    """COPY the rows into a staging table, then upsert them from it"""
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await db.execute(
+        text(
+            "CREATE TEMP TABLE posts_staging "
+            "(LIKE posts INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+    )
+    await raw_connection.driver_connection.copy_records_to_table(
+        "posts_staging",
+        records=[
+            (
+                row["id"],
+                row["source"],
+                row["search_query"],
+                row["created_at"],
+                json.dumps(row["raw_data"]),
+            )
+            for row in rows
+        ],
+        columns=["id", "source", "search_query", "created_at", "raw_data"],
+    )
+    result = await db.execute(
+        text(
+            "INSERT INTO posts "
+            "(id, source, search_query, created_at, raw_data) "
+            "SELECT id, source, search_query, created_at, raw_data "
+            "FROM posts_staging "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "created_at = EXCLUDED.created_at, raw_data = EXCLUDED.raw_data "
+            "WHERE posts.raw_data IS DISTINCT FROM EXCLUDED.raw_data "
+            "RETURNING (xmax = 0)"
+        )
+    )
+    flags = result.scalars().all()
+    await db.execute(text("DROP TABLE posts_staging"))
+    return _count_upserted(flags, len(rows))
 
 
 async def save_submissions(
@@ -57,66 +181,193 @@ async def save_submissions(
     search_query: str,
     submissions: List[Dict],
     source: str,
-    latest_submission: Optional[datetime] = None,
+    use_copy: Optional[bool] = None,
+) -> Dict[str, int]:
+    """
+    Upsert submissions into the posts table without committing.
+
+    New posts are inserted, stored posts whose data changed are updated and
+    the rest are skipped, so posts seen before never abort the transaction.
+    Batches of at least POSTS_COPY_THRESHOLD rows are loaded with COPY
+    unless `use_copy` says otherwise.
+
+    Returns:
+        Counts of posts inserted, updated and skipped
+    """
+    rows = _post_rows(search_query, submissions, source)
+    if not rows:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+    if use_copy is None:
+        use_copy = len(rows) >= POSTS_COPY_THRESHOLD
+    if use_copy:
+        return await _copy_posts(db, rows)
+    return await _upsert_posts(db, rows)
+
+
+async def _lock_search_query(db: AsyncSession, search_query: str):
+    """Serialize writers of a query's structured output until commit"""
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+        {"key": f"structured_output:{search_query}"},
+    )
+
+
+async def _insert_reviews(
+    db: AsyncSession, structured_output_id: int, reviews: List[Dict]
 ):
-    """Save submissions to the database depending on the source"""
-    for submission in submissions:
-        created_at = (
-            datetime.utcfromtimestamp(submission["created"])
-            if source == "reddit"
-            else datetime.strptime(
-                submission["created_at"], "%Y-%m-%dT%H:%M:%SZ"
+    """Insert reviews in one executemany, sent as multi-values batches"""
+    if reviews:
+        await db.execute(
+            insert(Review),
+            [
+                {"structured_output_id": structured_output_id, **review}
+                for review in reviews
+            ],
+        )
+
+
+async def save_structured_output(
+    search_query: str, data: Dict, db: AsyncSession, replace: bool = False
+) -> int:
+    """
+    Store a query's structured output and its reviews in one transaction.
+
+    Concurrent writers of the same query are serialized with an advisory
+    lock, so a query never gets two outputs and readers never see an
+    output without its reviews. An existing output is returned unchanged,
+    or with `replace` refreshed in place so history links stay valid.
+
+    Returns:
+        The id of the structured output
+    """
+    reviews = data.get("reviews", [])
+    try:
+        await _lock_search_query(db, search_query)
+        result = await db.execute(
+            select(StructuredOutput.id).filter(
+                StructuredOutput.search_query == search_query
             )
         )
+        structured_output_id = result.scalar()
 
-        if latest_submission is None or created_at >= latest_submission:
-            post = Posts(
-                id=submission["id"],
-                source=source,
-                search_query=search_query,
-                created_at=created_at,
-                raw_data=submission,
+        if structured_output_id is not None and not replace:
+            await db.commit()
+            return structured_output_id
+
+        if structured_output_id is not None:
+            await db.execute(
+                delete(Review).filter(
+                    Review.structured_output_id == structured_output_id
+                )
+            )
+            await db.execute(
+                update(StructuredOutput)
+                .filter(StructuredOutput.id == structured_output_id)
+                .values(
+                    overall_decision=data.get("overall_decision", ""),
+                    updated_at=func.now(),
+                )
             )
-            db.add(post)
+        else:
+            result = await db.execute(
+                insert(StructuredOutput)
+                .values(
+                    search_query=search_query,
+                    overall_decision=data.get("overall_decision", ""),
+                )
+                .returning(StructuredOutput.id)
+            )
+            structured_output_id = result.scalar_one()
+
+        await _insert_reviews(db, structured_output_id, reviews)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
 
+    logger.info(
+        f"Saved structured output {structured_output_id} for "
+        f"'{search_query}' with {len(reviews)} reviews"
+    )
+    return structured_output_id
 
-async def save_structured_output(
-    search_query: str, data: Dict, db: AsyncSession
+
+async def merge_structured_output(
+    search_query: str,
+    reviews: List[Dict],
+    db: AsyncSession,
+    decide: Callable[[List[Dict]], str],
 ) -> Optional[StructuredOutput]:
+    """
+    Add reviews of newly analyzed posts to an existing structured output.
+
+    Reviews of posts that already have reviews are skipped. The overall
+    decision is recomputed with `decide` from all reviews after the merge.
+
+    Returns:
+        The updated structured output, or None if the query has none
+    """
+    await _lock_search_query(db, search_query)
+    # Reload under the lock in case another writer changed the reviews
     result = await db.execute(
-        select(StructuredOutput).filter(
-            StructuredOutput.search_query == search_query
-        )
+        select(StructuredOutput)
+        .filter(StructuredOutput.search_query == search_query)
+        .execution_options(populate_existing=True)
     )
-    existing_output = result.scalar_one_or_none()
-    if existing_output:
-        return existing_output
-
-    # Create StructuredOutput
-    structured_output = StructuredOutput(
-        search_query=search_query,
-        overall_decision=data.get("overall_decision", ""),
-    )
-
-    db.add(structured_output)
-    await db.commit()
-    await db.refresh(structured_output)
+    structured_output = result.scalar_one_or_none()
+    if not structured_output:
+        await db.commit()
+        return None
 
-    # Create Review records
-    for review_data in data.get("reviews", []):
-        review = Review(
-            structured_output_id=structured_output.id, **review_data
-        )
-        db.add(review)
+    known_posts = {review.post_id for review in structured_output.reviews}
+    new_reviews = [
+        review for review in reviews if review.get("post_id") not in known_posts
+    ]
+    await _insert_reviews(db, structured_output.id, new_reviews)
 
+    structured_output.overall_decision = decide(
+        [_review_to_dict(review) for review in structured_output.reviews]
+        + new_reviews
+    )
+    structured_output.updated_at = func.now()
     await db.commit()
+    await db.refresh(structured_output, ["updated_at", "reviews"])
+    logger.info(
+        f"Merged {len(new_reviews)} new reviews into '{search_query}'"
+    )
     return structured_output
 
 
+def _review_to_dict(review: Review) -> Dict:
+    return {
+        "source": review.source,
+        "product_name": review.product_name,
+        "review_summary": review.review_summary,
+        "pros": review.pros,
+        "cons": review.cons,
+        "sentiment": review.sentiment,
+        "is_product_of_interest": review.is_product_of_interest,
+        "post_id": review.post_id,
+        "detail_score": review.detail_score,
+        "balanced_score": review.balanced_score,
+        "well_written_score": review.well_written_score,
+        "url": review.url,
+        "star_rating": review.star_rating,
+    }
+
+
 async def load_structured_output(
     search_query: str, db: AsyncSession
 ) -> Optional[Dict]:
     """Get structured output with reviews"""
+    entry = await load_structured_output_entry(search_query, db)
+    return entry[0] if entry else None
+
+
+async def load_structured_output_entry(
+    search_query: str, db: AsyncSession
+) -> Optional[Tuple[Dict, datetime]]:
+    """Get structured output with reviews and the time it was last updated"""
 
     result = await db.execute(
         select(StructuredOutput).filter(
@@ -128,22 +379,7 @@ async def load_structured_output(
         return None
 
     reviews = [
-        {
-            "source": review.source,
-            "product_name": review.product_name,
-            "review_summary": review.review_summary,
-            "pros": review.pros,
-            "cons": review.cons,
-            "sentiment": review.sentiment,
-            "is_product_of_interest": review.is_product_of_interest,
-            "post_id": review.post_id,
-            "detail_score": review.detail_score,
-            "balanced_score": review.balanced_score,
-            "well_written_score": review.well_written_score,
-            "url": review.url,
-            "star_rating": review.star_rating,
-        }
-        for review in structured_output.reviews
+        _review_to_dict(review) for review in structured_output.reviews
     ]
 
     return {
@@ -151,7 +387,7 @@ async def load_structured_output(
         "search_query": structured_output.search_query,
         "overall_decision": structured_output.overall_decision,
         "reviews": reviews,
-    }
+    }, structured_output.updated_at or structured_output.created_at
 
 
 async def get_existing_search_queries(db: AsyncSession) -> List[str]:
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
 
 
 class UserBase(BaseModel):
@@ -27,6 +27,24 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 
+class Principal(BaseModel):
+    """The authenticated user, with only the columns auth needs"""
+
+    id: int
+    username: str
+    is_active: bool
+    has_reddit_refresh_token: bool = False
+
+    @field_validator("has_reddit_refresh_token", mode="before")
+    @classmethod
+    def _null_is_false(cls, value):
+        # The column is nullable; rows that predate it hold NULL
+        return bool(value)
+
+    class Config:
+        from_attributes = True
+
+
 class ReviewBase(BaseModel):
     source: str
     product_name: str
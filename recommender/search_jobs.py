@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from recommender.database import async_session
+from recommender.models import SearchJob
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEARCH_JOB_WORKERS = int(os.getenv("SEARCH_JOB_WORKERS", "2"))
+SEARCH_JOB_MAX_ATTEMPTS = int(os.getenv("SEARCH_JOB_MAX_ATTEMPTS", "3"))
+SEARCH_JOB_POLL_SECONDS = float(os.getenv("SEARCH_JOB_POLL_SECONDS", "2"))
+# Workers update the heartbeat of their running jobs this often
+SEARCH_JOB_HEARTBEAT_SECONDS = float(
+    os.getenv("SEARCH_JOB_HEARTBEAT_SECONDS", "30")
+)
+# Running jobs without a heartbeat for this long are assumed to belong to
+# a dead worker; they count as a failed attempt
+SEARCH_JOB_STALE_SECONDS = float(os.getenv("SEARCH_JOB_STALE_SECONDS", "120"))
+# Delay before the first retry, doubled with each further attempt
+SEARCH_JOB_RETRY_SECONDS = float(os.getenv("SEARCH_JOB_RETRY_SECONDS", "30"))
+
+ACTIVE_STATUSES = ("queued", "running")
+TERMINAL_STATUSES = ("done", "failed")
+
+
+def format_job(job: SearchJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "search_query": job.search_query,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+async def enqueue_search_job(
+    search_query: str, params: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Queue a search, or return the active job already queued for the query.
+
+    Args:
+        search_query: Normalized search query
+        params: Keyword arguments passed to the job runner
+
+    Returns:
+        The job, formatted for API responses
+    """
+    async with async_session() as db:
+        await db.execute(
+            insert(SearchJob)
+            .values(
+                id=uuid.uuid4().hex,
+                search_query=search_query,
+                status="queued",
+                params=params or {},
+                attempts=0,
+            )
+            .on_conflict_do_nothing(
+                index_elements=[SearchJob.search_query],
+                index_where=SearchJob.status.in_(ACTIVE_STATUSES),
+            )
+        )
+        await db.commit()
+
+        result = await db.execute(
+            select(SearchJob)
+            .filter(SearchJob.search_query == search_query)
+            .filter(SearchJob.status.in_(ACTIVE_STATUSES))
+        )
+        job = result.scalar_one_or_none()
+        if job is None:
+            # The active job finished between the insert and the lookup
+            result = await db.execute(
+                select(SearchJob)
+                .filter(SearchJob.search_query == search_query)
+                .order_by(SearchJob.updated_at.desc())
+                .limit(1)
+            )
+            job = result.scalar_one()
+
+    search_job_workers.wake()
+    return format_job(job)
+
+
+async def get_search_job(job_id: str) -> Optional[Dict[str, Any]]:
+    async with async_session() as db:
+        job = await db.get(SearchJob, job_id)
+        return format_job(job) if job else None
+
+
+class SearchJobWorkers:
+    """
+    Pool of background workers running queued searches.
+
+    Jobs are claimed from the search_jobs table with SELECT ... FOR UPDATE
+    SKIP LOCKED, so several processes can share the queue. Each process
+    runs at most `workers` jobs at a time and keeps the heartbeat of its
+    running jobs current. Failed jobs, and running jobs whose heartbeat
+    stopped, are retried with exponential backoff until they have been
+    attempted `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        workers: int = SEARCH_JOB_WORKERS,
+        max_attempts: int = SEARCH_JOB_MAX_ATTEMPTS,
+        poll_seconds: float = SEARCH_JOB_POLL_SECONDS,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._runner: Optional[Callable[..., Awaitable[Dict]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, runner: Callable[..., Awaitable[Dict]]):
+        """
+        Start the workers.
+
+        Args:
+            runner: Coroutine function called as runner(search_query,
+                **params) that returns the search result or raises
+        """
+        self._runner = runner
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._work(worker))
+            for worker in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} search job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _retry_values(self, attempts: int, error: str) -> Dict[str, Any]:
+        """Column values requeuing a failed attempt, or failing the job"""
+        if attempts >= self.max_attempts:
+            return {"status": "failed", "error": error}
+        delay = SEARCH_JOB_RETRY_SECONDS * 2 ** max(attempts - 1, 0)
+        return {
+            "status": "queued",
+            "error": error,
+            "run_after": datetime.now(timezone.utc) + timedelta(seconds=delay),
+        }
+
+    async def _requeue_stale(self, db):
+        cutoff = datetime.now(timezone.utc) - timedelta(
+            seconds=SEARCH_JOB_STALE_SECONDS
+        )
+        result = await db.execute(
+            select(SearchJob.id, SearchJob.attempts)
+            .filter(SearchJob.status == "running")
+            .filter(
+                func.coalesce(SearchJob.heartbeat_at, SearchJob.updated_at)
+                < cutoff
+            )
+            .with_for_update(skip_locked=True)
+        )
+        for job_id, attempts in result.all():
+            logger.warning(f"Search job {job_id} lost its worker")
+            await db.execute(
+                update(SearchJob)
+                .filter(SearchJob.id == job_id)
+                .values(
+                    **self._retry_values(
+                        attempts, "The worker running the job stopped"
+                    )
+                )
+            )
+
+    async def _claim(self) -> Optional[SearchJob]:
+        async with async_session() as db:
+            await self._requeue_stale(db)
+            next_job = (
+                select(SearchJob.id)
+                .filter(SearchJob.status == "queued")
+                .filter(
+                    or_(
+                        SearchJob.run_after.is_(None),
+                        SearchJob.run_after <= func.now(),
+                    )
+                )
+                .order_by(SearchJob.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            result = await db.execute(
+                update(SearchJob)
+                .filter(SearchJob.id == next_job)
+                .values(
+                    status="running",
+                    attempts=SearchJob.attempts + 1,
+                    heartbeat_at=func.now(),
+                )
+                .returning(SearchJob)
+            )
+            job = result.scalar_one_or_none()
+            await db.commit()
+            return job
+
+    async def _finish(self, job: SearchJob, **values):
+        """
+        Record the outcome of this attempt, unless the job was requeued as
+        stale and possibly claimed again in the meantime
+        """
+        async with async_session() as db:
+            result = await db.execute(
+                update(SearchJob)
+                .filter(SearchJob.id == job.id)
+                .filter(SearchJob.status == "running")
+                .filter(SearchJob.attempts == job.attempts)
+                .values(**values)
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            logger.warning(
+                f"Search job {job.id} attempt {job.attempts} was superseded, "
+                "discarding its outcome"
+            )
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(SEARCH_JOB_HEARTBEAT_SECONDS)
+            try:
+                async with async_session() as db:
+                    await db.execute(
+                        update(SearchJob)
+                        .filter(SearchJob.id == job_id)
+                        .filter(SearchJob.status == "running")
+                        .values(heartbeat_at=func.now())
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.error(f"Search job {job_id} heartbeat error: {str(e)}")
+
+    async def _run(self, job: SearchJob):
+        logger.info(
+            f"Running search job {job.id} for '{job.search_query}' "
+            f"(attempt {job.attempts})"
+        )
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            result = await self._runner(job.search_query, **(job.params or {}))
+        except Exception as e:
+            values = self._retry_values(job.attempts, str(e))
+            logger.error(
+                f"Search job {job.id} failed: {str(e)}"
+                f"{', retrying' if values['status'] == 'queued' else ''}",
+                exc_info=True,
+            )
+            await self._finish(job, **values)
+            return
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+        await self._finish(job, status="done", result=result, error=None)
+
+    async def _work(self, worker: int):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Search job worker {worker} error: {str(e)}")
+                job = None
+
+            if job is not None:
+                try:
+                    await self._run(job)
+                except Exception as e:
+                    # Keep the worker alive; a job left running is requeued
+                    # once its heartbeat goes stale
+                    logger.error(
+                        f"Search job worker {worker} error running job "
+                        f"{job.id}: {str(e)}",
+                        exc_info=True,
+                    )
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.poll_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+search_job_workers = SearchJobWorkers()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from recommender.database import dedicated_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEARCH_ADVISORY_LOCK = (
+    os.getenv("SEARCH_ADVISORY_LOCK", "false").lower() == "true"
+)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key starts the work, every caller that arrives
+    while it is running awaits the same result. The work runs in its own
+    task, so a caller that disconnects does not cancel it for the others.
+    When `advisory_lock` is enabled the work additionally runs under a
+    Postgres advisory lock on the key, serializing identical work across
+    worker processes. A caller that got the lock after another process
+    finished the same work picks up its stored result through `recheck`.
+    """
+
+    def __init__(self, advisory_lock: bool = False):
+        self.advisory_lock = advisory_lock
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.stats = {"executions": 0, "shared": 0, "rechecked": 0}
+
+    async def run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        recheck: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        Run `func` for a key, or join the execution already running.
+
+        Args:
+            key: Identity of the work
+            func: Coroutine function doing the work
+            recheck: Coroutine function returning the stored result of the
+                work, or None; called once the advisory lock is acquired
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats["executions"] += 1
+            task = asyncio.create_task(self._execute(key, func, recheck))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.stats["shared"] += 1
+            logger.info(f"Joining in-flight execution for '{key}'")
+        return await asyncio.shield(task)
+
+    async def _execute(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        recheck: Optional[Callable[[], Awaitable[Any]]],
+    ):
+        if not self.advisory_lock:
+            return await func()
+
+        # The transaction-scoped lock is released when the block exits, even
+        # if the connection is lost, so a failed worker cannot leak it. The
+        # lock connection does not come from the request pool, which a few
+        # long searches would otherwise exhaust.
+        async with dedicated_engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                {"key": key},
+            )
+            if recheck is not None:
+                # Another worker may have stored the result while this one
+                # waited for the lock
+                stored = await recheck()
+                if stored is not None:
+                    self.stats["rechecked"] += 1
+                    return stored
+            return await func()
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+
+search_flight = SingleFlight(advisory_lock=SEARCH_ADVISORY_LOCK)
@@ -59,3 +59,42 @@ class AllReviewAnalysis(BaseModel):
     overall_decision: str = Field(
         description="The overall decision on the product based on the reviews, taking into account the pros, cons and sentiment of the reviews. Prioritize reviews with the best detail score, balance score and well written score"
     )
+
+
+class PostReviewAnalysis(AllReviewAnalysis):
+    post_id: str = Field(
+        description="The post_id of the post these reviews were extracted from"
+    )
+
+
+class PackedReviewAnalysis(BaseModel):
+    posts: List[PostReviewAnalysis] = Field(
+        description="One review analysis per post, for every post_id given, in the order the posts are given"
+    )
+
+
+class TranscriptChunkAnalysis(BaseModel):
+    product_name: Optional[str] = Field(
+        description="The name of the product discussed in this part of the video, if any"
+    )
+    is_product_of_interest: bool = Field(
+        description="Whether this part of the video reviews the product of interest"
+    )
+    summary: Optional[str] = Field(
+        description="A brief summary of what this part of the video says about the product"
+    )
+    pros: List[str] = Field(
+        description="list the pros of the product mentioned in this part of the video"
+    )
+    cons: List[str] = Field(
+        description="list the cons of the product mentioned in this part of the video"
+    )
+    sentiment: Optional[str] = Field(
+        description="The sentiment of this part of the video towards the product (positive, negative, neutral)"
+    )
+
+
+class TriageDecision(BaseModel):
+    is_review: bool = Field(
+        description="Whether the post or its comments contain a review or first-hand opinion of the product of interest"
+    )
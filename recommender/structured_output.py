@@ -1,76 +1,457 @@
 import asyncio
 import json
-from typing import Any, Dict, List
+import os
+from collections import Counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
-from langchain_openai import ChatOpenAI
 from rich import print
 
-from recommender.structured_data import AllReviewAnalysis
+from recommender.extraction_cache import (
+    extraction_cache_key,
+    get_cached_extractions,
+    save_extractions,
+)
+from recommender.llm_clients import get_structured_model
+from recommender.llm_scheduler import Priority, llm_scheduler
+from recommender.prompt_builder import (
+    build_post_context,
+    count_tokens,
+    record_prompt_stats,
+)
+from recommender.structured_data import (
+    AllReviewAnalysis,
+    PackedReviewAnalysis,
+    ProductReviewAnalysis,
+)
+from recommender.transcript_analysis import (
+    analyze_long_video,
+    is_long_transcript,
+)
+
+REVIEW_MODEL = "gpt-4o"
+# Bump whenever the extraction prompt changes to invalidate cached results
+PROMPT_VERSION = "3"
+REVIEW_TEMPERATURE = 0.1
+# Allowance for the structured completion when budgeting tokens
+REVIEW_OUTPUT_TOKENS = 1000
+# Prompt token budget of one packed multi-post request
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "6000"))
+# Weighted sentiment needed for a positive or negative aggregated decision
+DECISION_THRESHOLD = 0.3
+SENTIMENT_VALUES = {"positive": 1, "neutral": 0, "negative": -1}
+QUALITY_SCORES = ["detail_score", "balanced_score", "well_written_score"]
 
 
 async def process_post_for_product_review(
-    data: Dict[str, Any], search_query: str, source: str
+    data: Dict[str, Any],
+    search_query: str,
+    source: str,
+    priority: Priority = Priority.INTERACTIVE,
+    post_context: Optional[Tuple[str, Dict[str, int]]] = None,
 ) -> AllReviewAnalysis:
-    llm = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0.1,
+    structured_llm = get_structured_model(
+        REVIEW_MODEL, REVIEW_TEMPERATURE, AllReviewAnalysis
     )
-    structured_llm = llm.with_structured_output(AllReviewAnalysis)
+
+    context, stats = post_context or build_post_context(data)
+    record_prompt_stats(data["id"], stats)
 
     prompt = f"""
     Analyze the following {source} post and extract unique product reviews from it if and only if it is a product review.
     Indicate whether each extracted product review is a review of the product of interest: {search_query}
+    {context}
 
-    post_id: {data['id']}
-    post: {data['body']}
-    comments: {data.get('comments', [])}
     source: {source}
 
     Then provide an overall decision on whether the {search_query} is a good product to buy based on the reviews extracted.
     """
 
-    result = await structured_llm.ainvoke(prompt)
+    result = await llm_scheduler.submit(
+        lambda: structured_llm.ainvoke(prompt),
+        model=REVIEW_MODEL,
+        estimated_tokens=count_tokens(prompt) + REVIEW_OUTPUT_TOKENS,
+        priority=priority,
+    )
     return result
 
 
-async def batch_process_posts_for_product_review(
-    data_batch: List[Dict[str, Any]],
+async def process_packed_posts_for_product_review(
+    data_pack: List[Dict[str, Any]],
     search_query: str,
     source: str,
+    priority: Priority = Priority.INTERACTIVE,
+    contexts: Optional[Dict[int, Tuple[str, Dict[str, int]]]] = None,
 ) -> List[AllReviewAnalysis]:
-    tasks = [
-        process_post_for_product_review(data, search_query, source)
+    """
+    Analyze several posts in one request and split the results by post.
+    `contexts` holds post contexts already built by pack_posts.
+    """
+    contexts = contexts or {}
+    if len(data_pack) == 1:
+        return [
+            await process_post_for_product_review(
+                data_pack[0],
+                search_query,
+                source,
+                priority,
+                contexts.get(id(data_pack[0])),
+            )
+        ]
+
+    structured_llm = get_structured_model(
+        REVIEW_MODEL, REVIEW_TEMPERATURE, PackedReviewAnalysis
+    )
+
+    rendered = []
+    for data in data_pack:
+        context, stats = contexts.get(id(data)) or build_post_context(data)
+        record_prompt_stats(data["id"], stats)
+        rendered.append(context)
+    posts = "\n".join(rendered)
+    prompt = f"""
+    Analyze each of the following {source} posts separately and extract unique product reviews from each post if and only if it is a product review.
+    Indicate whether each extracted product review is a review of the product of interest: {search_query}
+    Return one entry per post, identified by its post_id.
+    {posts}
+
+    source: {source}
+
+    For each post, provide an overall decision on whether the {search_query} is a good product to buy based on the reviews extracted from that post.
+    """
+
+    result = await llm_scheduler.submit(
+        lambda: structured_llm.ainvoke(prompt),
+        model=REVIEW_MODEL,
+        estimated_tokens=count_tokens(prompt)
+        + REVIEW_OUTPUT_TOKENS * len(data_pack),
+        priority=priority,
+    )
+
+    by_post_id = {post.post_id: post for post in result.posts}
+    analyses = []
+    for data in data_pack:
+        post = by_post_id.get(str(data["id"]))
+        if post is None:
+            # The model dropped this post, analyze it on its own
+            print(f"post {data['id']} missing from packed response")
+            analyses.append(
+                await process_post_for_product_review(
+                    data,
+                    search_query,
+                    source,
+                    priority,
+                    contexts.get(id(data)),
+                )
+            )
+        else:
+            analyses.append(
+                AllReviewAnalysis(
+                    reviews=post.reviews,
+                    overall_decision=post.overall_decision,
+                )
+            )
+    return analyses
+
+
+def pack_posts(
+    data_batch: List[Dict[str, Any]],
+    token_budget: int,
+    contexts: Optional[Dict[int, Tuple[str, Dict[str, int]]]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Group posts into packs whose combined size fits the token budget.
+
+    Posts at least half the budget in size are sent on their own, smaller
+    posts are packed first-fit in their original order. The post contexts
+    built for measuring are stored in `contexts`, keyed by id(post), so
+    the prompts can reuse them.
+    """
+    if contexts is None:
+        contexts = {}
+    packs = []
+    open_packs = []
+    for data in data_batch:
+        if id(data) not in contexts:
+            contexts[id(data)] = build_post_context(data)
+        tokens = contexts[id(data)][1]["tokens_after"]
+        if tokens * 2 >= token_budget:
+            packs.append([data])
+            continue
+        for pack in open_packs:
+            if pack["tokens"] + tokens <= token_budget:
+                pack["posts"].append(data)
+                pack["tokens"] += tokens
+                break
+        else:
+            pack = {"posts": [data], "tokens": tokens}
+            open_packs.append(pack)
+            packs.append(pack["posts"])
+    return packs
+
+
+def plan_analysis(
+    posts: List[Dict[str, Any]],
+    search_query: str,
+    source: str,
+    priority: Priority = Priority.INTERACTIVE,
+    pack: bool = False,
+    pack_token_budget: int = PACK_TOKEN_BUDGET,
+) -> List[Tuple[List[Dict[str, Any]], Awaitable]]:
+    """
+    Plan the extraction requests for posts.
+
+    Long video transcripts are analyzed with map-reduce, the remaining
+    posts are packed into shared requests or sent one per request.
+
+    Returns:
+        Groups of posts together with the coroutine analyzing them
+    """
+    long_videos = []
+    if source == "youtube":
+        long_videos = [data for data in posts if is_long_transcript(data)]
+    long_ids = {id(data) for data in long_videos}
+    regular = [data for data in posts if id(data) not in long_ids]
+
+    groups = [
+        (
+            [data],
+            analyze_long_video(
+                data, search_query, REVIEW_MODEL, REVIEW_TEMPERATURE, priority
+            ),
+        )
+        for data in long_videos
+    ]
+    if pack:
+        contexts = {}
+        packs = pack_posts(regular, pack_token_budget, contexts)
+        print(f"packed {len(regular)} posts into {len(packs)} requests")
+        groups.extend(
+            (
+                data_pack,
+                process_packed_posts_for_product_review(
+                    data_pack, search_query, source, priority, contexts
+                ),
+            )
+            for data_pack in packs
+        )
+    else:
+        groups.extend(
+            (
+                [data],
+                process_post_for_product_review(
+                    data, search_query, source, priority
+                ),
+            )
+            for data in regular
+        )
+    return groups
+
+
+async def iter_post_analyses(
+    data_batch: List[Dict[str, Any]],
+    search_query: str,
+    source: str,
+    priority: Priority = Priority.INTERACTIVE,
+    pack: bool = False,
+    pack_token_budget: int = PACK_TOKEN_BUDGET,
+) -> AsyncIterator[Tuple[Dict[str, Any], AllReviewAnalysis]]:
+    """
+    Yield (post, analysis) pairs for a batch as soon as each is available.
+
+    Cached extractions are yielded first, the rest as their requests
+    finish. New results are written to the extraction cache per request.
+    """
+    cache_keys = {
+        id(data): extraction_cache_key(
+            data, search_query, source, REVIEW_MODEL, PROMPT_VERSION
+        )
         for data in data_batch
+    }
+    cached = await get_cached_extractions(list(cache_keys.values()))
+    missing = [
+        data for data in data_batch if cache_keys[id(data)] not in cached
+    ]
+    print(
+        f"{len(data_batch) - len(missing)} cached, {len(missing)} to analyze"
+    )
+
+    for data in data_batch:
+        if cache_keys[id(data)] in cached:
+            yield data, cached[cache_keys[id(data)]]
+
+    async def run(group: List[Dict[str, Any]], analysis: Awaitable):
+        results = await analysis
+        # Single-post requests return one analysis, packed requests a list
+        if not isinstance(results, list):
+            results = [results]
+        await save_extractions(
+            [
+                {
+                    "cache_key": cache_keys[id(data)],
+                    "post_id": data["id"],
+                    "source": source,
+                    "model": REVIEW_MODEL,
+                    "prompt_version": PROMPT_VERSION,
+                    "result": result,
+                }
+                for data, result in zip(group, results)
+            ]
+        )
+        return list(zip(group, results))
+
+    tasks = [
+        asyncio.create_task(run(group, analysis))
+        for group, analysis in plan_analysis(
+            missing, search_query, source, priority, pack, pack_token_budget
+        )
     ]
-    return await asyncio.gather(*tasks)
+    try:
+        for finished in asyncio.as_completed(tasks):
+            for data, result in await finished:
+                yield data, result
+    finally:
+        # Stop outstanding requests if the consumer goes away early
+        for task in tasks:
+            task.cancel()
+
+
+async def batch_process_posts_for_product_review(
+    data_batch: List[Dict[str, Any]],
+    search_query: str,
+    source: str,
+    priority: Priority = Priority.INTERACTIVE,
+    pack: bool = False,
+    pack_token_budget: int = PACK_TOKEN_BUDGET,
+) -> List[AllReviewAnalysis]:
+    results = {}
+    async for data, analysis in iter_post_analyses(
+        data_batch, search_query, source, priority, pack, pack_token_budget
+    ):
+        results[id(data)] = analysis
+    return [results[id(data)] for data in data_batch]
+
+
+def review_to_dict(review: ProductReviewAnalysis) -> dict[str, Any]:
+    return {
+        "source": review.source,
+        "product_name": review.product_name,
+        "review_summary": review.review_summary,
+        "pros": review.pros,
+        "cons": review.cons,
+        "sentiment": review.sentiment,
+        "is_product_of_interest": review.is_product_of_interest,
+        "post_id": review.post_id,
+        "detail_score": review.detail_score,
+        "balanced_score": review.balanced_score,
+        "well_written_score": review.well_written_score,
+        "url": review.url,
+        "star_rating": review.star_rating,
+    }
 
 
 def convert_to_dict(review_analysis: AllReviewAnalysis) -> dict[str, Any]:
     return {
         "reviews": [
-            {
-                "source": review.source,
-                "product_name": review.product_name,
-                "review_summary": review.review_summary,
-                "pros": review.pros,
-                "cons": review.cons,
-                "sentiment": review.sentiment,
-                "is_product_of_interest": review.is_product_of_interest,
-                "post_id": review.post_id,
-                "detail_score": review.detail_score,
-                "balanced_score": review.balanced_score,
-                "well_written_score": review.well_written_score,
-                "url": review.url,
-                "star_rating": review.star_rating,
-            }
-            for review in review_analysis.reviews
+            review_to_dict(review) for review in review_analysis.reviews
         ],
         "overall_decision": review_analysis.overall_decision or "",
     }
 
 
+def most_common_decision(overall_decisions: List[str]) -> Optional[str]:
+    if not overall_decisions:
+        return None
+    return max(set(overall_decisions), key=overall_decisions.count)
+
+
+def aggregate_decision(
+    reviews: List[Dict[str, Any]], search_query: str
+) -> str:
+    """
+    Overall decision computed from stored reviews without an LLM call.
+
+    Reviews of the product of interest vote with their sentiment, weighted
+    by their detail, balanced and well-written scores. The decision names
+    the verdict, the sentiment counts, the average star rating and the
+    most mentioned pros and cons.
+    """
+    relevant = [
+        review
+        for review in reviews
+        if review.get("is_product_of_interest") and review.get("review_summary")
+    ]
+    if not relevant:
+        return f"Not enough reviews of {search_query} to make a decision."
+
+    counts = Counter(
+        (review.get("sentiment") or "neutral").lower() for review in relevant
+    )
+    total_weight = 0.0
+    weighted_sentiment = 0.0
+    for review in relevant:
+        quality = sum(review.get(score) or 0 for score in QUALITY_SCORES)
+        weight = 1 + quality / 30
+        total_weight += weight
+        weighted_sentiment += weight * SENTIMENT_VALUES.get(
+            (review.get("sentiment") or "").lower(), 0
+        )
+    score = weighted_sentiment / total_weight
+
+    if score >= DECISION_THRESHOLD:
+        verdict = f"{search_query} is recommended"
+    elif score <= -DECISION_THRESHOLD:
+        verdict = f"{search_query} is not recommended"
+    else:
+        verdict = f"Reviews of {search_query} are mixed"
+
+    ratings = [
+        review["star_rating"]
+        for review in relevant
+        if review.get("star_rating") is not None
+    ]
+    rating = (
+        f", average rating {sum(ratings) / len(ratings):.1f}/5"
+        if ratings
+        else ""
+    )
+
+    def most_mentioned(field: str) -> str:
+        mentions = Counter(
+            item.strip().lower()
+            for review in relevant
+            for item in review.get(field) or []
+            if item and item.strip()
+        )
+        return "; ".join(item for item, _ in mentions.most_common(3))
+
+    decision = (
+        f"{verdict} based on {len(relevant)} reviews "
+        f"({counts['positive']} positive, {counts['neutral']} neutral, "
+        f"{counts['negative']} negative{rating})."
+    )
+    pros, cons = most_mentioned("pros"), most_mentioned("cons")
+    if pros:
+        decision += f" Most mentioned pros: {pros}."
+    if cons:
+        decision += f" Most mentioned cons: {cons}."
+    return decision
+
+
 async def process_all_posts(
-    data: dict, search_query: str, batch_size: int
+    data: dict,
+    search_query: str,
+    batch_size: int,
+    priority: Priority = Priority.INTERACTIVE,
+    pack: bool = False,
+    pack_token_budget: int = PACK_TOKEN_BUDGET,
 ) -> AllReviewAnalysis:
     combined_reviews = []
     overall_decisions = []
@@ -91,7 +472,12 @@ async def process_all_posts(
         )
         for batch in batches:
             results = await batch_process_posts_for_product_review(
-                batch, search_query, source
+                batch,
+                search_query,
+                source,
+                priority,
+                pack,
+                pack_token_budget,
             )
 
             for analysis in results:
@@ -99,14 +485,9 @@ async def process_all_posts(
                 if analysis.overall_decision:
                     overall_decisions.append(analysis.overall_decision)
 
-    final_decision = None
-    if overall_decisions:
-        # Combine individual decisions into a final decision
-        print(overall_decisions)
-        final_decision = max(
-            set(overall_decisions),
-            key=overall_decisions.count,
-        )
+    # Combine individual decisions into a final decision
+    print(overall_decisions)
+    final_decision = most_common_decision(overall_decisions)
 
     all_review_analysis = AllReviewAnalysis(
         reviews=combined_reviews,
@@ -115,6 +496,90 @@ async def process_all_posts(
     return convert_to_dict(all_review_analysis)
 
 
+async def stream_all_posts(
+    data: dict,
+    search_query: str,
+    batch_size: int,
+    priority: Priority = Priority.INTERACTIVE,
+    pack: bool = False,
+    pack_token_budget: int = PACK_TOKEN_BUDGET,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming counterpart of process_all_posts.
+
+    Yields events as posts are analyzed:
+        progress: {"stage": "analyzing", "completed": n, "total": n}
+        review: a review with a summary, in the convert_to_dict format
+        decision: the provisional overall decision so far
+        result: the final result in the process_all_posts format
+    """
+    combined_reviews = []
+    overall_decisions = []
+    posts = data.get(search_query, [{}])[0]
+    total = sum(
+        len(posts.get(source, [])) for source in ["reddit", "youtube"]
+    )
+    completed = 0
+
+    yield {
+        "event": "progress",
+        "data": {"stage": "analyzing", "completed": 0, "total": total},
+    }
+
+    for source in ["reddit", "youtube"]:
+        post = posts.get(source, [])
+        batches = [
+            post[i : i + batch_size] for i in range(0, len(post), batch_size)
+        ]
+        for batch in batches:
+            async for _, analysis in iter_post_analyses(
+                batch,
+                search_query,
+                source,
+                priority,
+                pack,
+                pack_token_budget,
+            ):
+                completed += 1
+                for review in analysis.reviews:
+                    combined_reviews.append(review)
+                    if review.review_summary is not None:
+                        yield {
+                            "event": "review",
+                            "data": review_to_dict(review),
+                        }
+
+                if analysis.overall_decision:
+                    overall_decisions.append(analysis.overall_decision)
+                    yield {
+                        "event": "decision",
+                        "data": {
+                            "overall_decision": most_common_decision(
+                                overall_decisions
+                            ),
+                            "provisional": True,
+                        },
+                    }
+
+                yield {
+                    "event": "progress",
+                    "data": {
+                        "stage": "analyzing",
+                        "completed": completed,
+                        "total": total,
+                    },
+                }
+
+    yield {
+        "event": "result",
+        "data": {
+            "reviews": [review_to_dict(review) for review in combined_reviews],
+            "overall_decision": most_common_decision(overall_decisions)
+            or "",
+        },
+    }
+
+
 async def main():
     with open("data/iphone 16.json", "r") as file:
         data = json.load(file)
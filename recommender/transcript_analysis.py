@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from recommender.llm_clients import get_structured_model
+from recommender.llm_scheduler import Priority, llm_scheduler
+from recommender.prompt_builder import (
+    POST_TOKEN_BUDGET,
+    clean_text,
+    compact_comments,
+    count_tokens,
+    split_by_tokens,
+)
+from recommender.structured_data import (
+    AllReviewAnalysis,
+    TranscriptChunkAnalysis,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_CHUNK_TOKENS", "2000"))
+TRANSCRIPT_PARALLELISM = int(os.getenv("TRANSCRIPT_PARALLELISM", "4"))
+# Transcripts longer than this are analyzed in chunks
+LONG_TRANSCRIPT_TOKENS = int(
+    os.getenv("LONG_TRANSCRIPT_TOKENS", str(POST_TOKEN_BUDGET))
+)
+# Allowance for the structured completions when budgeting tokens
+CHUNK_OUTPUT_TOKENS = 400
+MERGE_OUTPUT_TOKENS = 1000
+MERGE_COMMENT_TOKENS = 1000
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def is_long_transcript(data: Dict[str, Any]) -> bool:
+    return count_tokens(clean_text(data.get("body"))) > LONG_TRANSCRIPT_TOKENS
+
+
+def _format_time(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def split_transcript(
+    data: Dict[str, Any], chunk_tokens: int = TRANSCRIPT_CHUNK_TOKENS
+) -> List[Dict[str, Any]]:
+    """
+    Split a video transcript into chunks of at most chunk_tokens tokens.
+
+    Timed caption segments are used when available so that chunks start on
+    segment boundaries, otherwise the transcript is split into sentences.
+    Runs without any boundary, such as unpunctuated captions, are split on
+    token boundaries.
+
+    Returns:
+        List of chunks with their start time in seconds (or None) and text
+    """
+    segments = data.get("transcript_segments")
+    if segments:
+        units = [
+            (segment["start"], clean_text(segment["text"]))
+            for segment in segments
+        ]
+    else:
+        units = [
+            (None, sentence)
+            for sentence in SENTENCE_PATTERN.split(clean_text(data["body"]))
+        ]
+
+    chunks = []
+    current = {"start": None, "texts": [], "tokens": 0}
+
+    def flush():
+        if current["texts"]:
+            chunks.append(
+                {"start": current["start"], "text": " ".join(current["texts"])}
+            )
+        current.update({"start": None, "texts": [], "tokens": 0})
+
+    for start, text in units:
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if tokens > chunk_tokens:
+            flush()
+            for piece in split_by_tokens(text, chunk_tokens):
+                chunks.append({"start": start, "text": piece})
+            continue
+        if current["tokens"] + tokens > chunk_tokens:
+            flush()
+        if not current["texts"]:
+            current["start"] = start
+        current["texts"].append(text)
+        current["tokens"] += tokens
+    flush()
+
+    return chunks
+
+
+async def analyze_transcript_chunk(
+    chunk: Dict[str, Any],
+    index: int,
+    total: int,
+    data: Dict[str, Any],
+    search_query: str,
+    model: str,
+    temperature: float,
+    priority: Priority = Priority.INTERACTIVE,
+) -> TranscriptChunkAnalysis:
+    structured_llm = get_structured_model(
+        model, temperature, TranscriptChunkAnalysis
+    )
+    starts_at = (
+        f", starting at {_format_time(chunk['start'])}"
+        if chunk["start"] is not None
+        else ""
+    )
+
+    prompt = f"""
+    The following is part {index + 1} of {total} of the transcript of the YouTube video "{clean_text(data.get('title'))}"{starts_at}.
+    Extract what this part of the video says about the product of interest: {search_query}
+
+    transcript: {chunk['text']}
+    """
+
+    return await llm_scheduler.submit(
+        lambda: structured_llm.ainvoke(prompt),
+        model=model,
+        estimated_tokens=count_tokens(prompt) + CHUNK_OUTPUT_TOKENS,
+        priority=priority,
+    )
+
+
+def _format_partial(
+    chunk: Dict[str, Any], index: int, partial: TranscriptChunkAnalysis
+) -> str:
+    starts_at = _format_time(chunk["start"])
+    return (
+        f"- part {index + 1}{f' ({starts_at})' if starts_at else ''}: "
+        f"product: {partial.product_name}; "
+        f"about product of interest: {partial.is_product_of_interest}; "
+        f"sentiment: {partial.sentiment}; summary: {partial.summary}; "
+        f"pros: {'; '.join(partial.pros)}; cons: {'; '.join(partial.cons)}"
+    )
+
+
+async def analyze_long_video(
+    data: Dict[str, Any],
+    search_query: str,
+    model: str,
+    temperature: float,
+    priority: Priority = Priority.INTERACTIVE,
+    chunk_tokens: int = TRANSCRIPT_CHUNK_TOKENS,
+    parallelism: int = TRANSCRIPT_PARALLELISM,
+) -> AllReviewAnalysis:
+    """
+    Analyze a long video transcript with map-reduce.
+
+    Chunks of the transcript are analyzed in parallel, then their partial
+    results are merged into a single review of the video together with
+    any reviews found in the video's comments.
+
+    Args:
+        data: YouTube video dictionary
+        search_query: Product of interest
+        model: Model used for both stages
+        temperature: Sampling temperature
+        priority: Scheduling class of the LLM calls
+        chunk_tokens: Maximum transcript tokens per chunk
+        parallelism: Maximum chunks analyzed concurrently for this video
+
+    Returns:
+        Review analysis for the video
+    """
+    chunks = split_transcript(data, chunk_tokens)
+    logger.info(f"Analyzing video {data['id']} in {len(chunks)} chunks")
+
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def analyze(index: int, chunk: Dict[str, Any]):
+        async with semaphore:
+            return await analyze_transcript_chunk(
+                chunk,
+                index,
+                len(chunks),
+                data,
+                search_query,
+                model,
+                temperature,
+                priority,
+            )
+
+    partials = await asyncio.gather(
+        *(analyze(index, chunk) for index, chunk in enumerate(chunks))
+    )
+
+    partial_lines = "\n".join(
+        _format_partial(chunk, index, partial)
+        for index, (chunk, partial) in enumerate(zip(chunks, partials))
+    )
+    comments, _ = compact_comments(
+        data.get("comments") or [], MERGE_COMMENT_TOKENS
+    )
+
+    structured_llm = get_structured_model(
+        model, temperature, AllReviewAnalysis
+    )
+    prompt = f"""
+    The following are analyses of consecutive parts of the YouTube video "{clean_text(data.get('title'))}".
+    Merge them into exactly one product review of the video: combine and deduplicate the pros and cons, summarize the video's review as a whole and give its overall sentiment.
+    Then extract unique product reviews from the video's comments if and only if they are product reviews.
+    Indicate whether each product review is a review of the product of interest: {search_query}
+
+    post_id: {data['id']}
+    url: {data.get('url', '')}
+    partial analyses:
+{partial_lines}
+    comments (comment id, score in brackets, replies indented):
+{comments}
+
+    source: youtube
+
+    Then provide an overall decision on whether the {search_query} is a good product to buy based on the reviews extracted.
+    """
+
+    return await llm_scheduler.submit(
+        lambda: structured_llm.ainvoke(prompt),
+        model=model,
+        estimated_tokens=count_tokens(prompt) + MERGE_OUTPUT_TOKENS,
+        priority=priority,
+    )
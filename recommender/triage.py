@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+from recommender.llm_clients import get_structured_model
+from recommender.llm_scheduler import Priority, llm_scheduler
+from recommender.prompt_builder import (
+    clean_text,
+    compact_comments,
+    count_tokens,
+    truncate_to_tokens,
+)
+from recommender.structured_data import TriageDecision
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRIAGE_USE_LLM = os.getenv("TRIAGE_USE_LLM", "false").lower() == "true"
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "gpt-4o-mini")
+# Posts scoring below the lower bound are dropped, above the upper bound
+# they are kept; in between the cheap model decides when enabled
+TRIAGE_REJECT_BELOW = float(os.getenv("TRIAGE_REJECT_BELOW", "0.3"))
+TRIAGE_ACCEPT_ABOVE = float(os.getenv("TRIAGE_ACCEPT_ABOVE", "0.6"))
+TRIAGE_PROMPT_TOKENS = 600
+# Sizes of the adjacent word groups matched when written together
+JOINED_NGRAM_SIZES = (2, 3)
+
+REVIEW_KEYWORDS = {
+    "review",
+    "reviews",
+    "pros",
+    "cons",
+    "worth",
+    "recommend",
+    "bought",
+    "buy",
+    "purchased",
+    "returned",
+    "upgrade",
+    "upgraded",
+    "experience",
+    "months",
+    "weeks",
+    "compared",
+    "vs",
+    "quality",
+    "battery",
+    "love",
+    "hate",
+    "disappointed",
+    "impressed",
+    "issue",
+    "issues",
+    "problem",
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+_stats = {
+    "posts": 0,
+    "kept": 0,
+    "rejected_by_heuristics": 0,
+    "rejected_by_model": 0,
+    "triage_llm_calls": 0,
+}
+
+
+def _words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def _post_text(data: Dict[str, Any]) -> str:
+    comments, _ = compact_comments(data.get("comments") or [], 500)
+    return " ".join(
+        [
+            clean_text(data.get("title")),
+            clean_text(data.get("description")),
+            clean_text(data.get("body")),
+            comments,
+        ]
+    )
+
+
+def _joined_ngrams(words: List[str]) -> Dict[str, Tuple[int, int]]:
+    """Adjacent words written together, mapped to their position and size"""
+    return {
+        "".join(words[i : i + size]): (i, size)
+        for size in JOINED_NGRAM_SIZES
+        for i in range(len(words) - size + 1)
+    }
+
+
+def product_match(text: str, search_query: str) -> float:
+    """
+    Fraction of the query's terms that appear in the text as whole words.
+
+    Terms written together on one side and apart on the other, e.g.
+    "iphone16" and "iphone 16", match through adjacent word pairs and
+    triples, never as substrings of longer words.
+    """
+    query_words = [
+        word for word in _words(search_query) if word not in REVIEW_KEYWORDS
+    ]
+    if not query_words:
+        return 1.0
+    words = _words(text)
+    vocabulary = set(words) | set(_joined_ngrams(words))
+
+    found = {word for word in query_words if word in vocabulary}
+    for joined, (i, size) in _joined_ngrams(query_words).items():
+        if joined in vocabulary:
+            found.update(query_words[i : i + size])
+    return len(found) / len(set(query_words))
+
+
+def heuristic_score(data: Dict[str, Any], search_query: str) -> float:
+    """
+    Estimate how likely a post is to contain reviews of the product.
+
+    Combines product-name match, review vocabulary, a length prior and a
+    popularity prior (Reddit score or YouTube views) into a 0-1 score.
+    """
+    text = _post_text(data)
+    words = _words(text)
+
+    match = product_match(text, search_query)
+    keywords = min(1.0, len(REVIEW_KEYWORDS.intersection(words)) / 4)
+    length = min(1.0, len(words) / 300)
+    popularity = data.get("score")
+    if popularity is None:
+        popularity = int(data.get("views") or 0) / 1000
+    popularity = min(1.0, math.log10(max(popularity, 0) + 1) / 3)
+
+    return 0.5 * match + 0.25 * keywords + 0.15 * length + 0.1 * popularity
+
+
+async def llm_triage(
+    data: Dict[str, Any],
+    search_query: str,
+    source: str,
+    priority: Priority = Priority.INTERACTIVE,
+) -> bool:
+    """Ask a small model whether the post contains reviews of the product"""
+    structured_llm = get_structured_model(TRIAGE_MODEL, 0, TriageDecision)
+    excerpt = truncate_to_tokens(_post_text(data), TRIAGE_PROMPT_TOKENS)
+    prompt = f"""
+    Does the following {source} post or its comments contain a review or first-hand opinion of: {search_query}?
+
+    {excerpt}
+    """
+
+    _stats["triage_llm_calls"] += 1
+    decision = await llm_scheduler.submit(
+        lambda: structured_llm.ainvoke(prompt),
+        model=TRIAGE_MODEL,
+        estimated_tokens=count_tokens(prompt) + 20,
+        priority=priority,
+    )
+    return decision.is_review
+
+
+async def triage_posts(
+    all_submissions: dict,
+    search_query: str,
+    use_llm: bool = TRIAGE_USE_LLM,
+    priority: Priority = Priority.INTERACTIVE,
+) -> Tuple[dict, Dict[str, int]]:
+    """
+    Drop posts unlikely to contain reviews of the product of interest.
+
+    Args:
+        all_submissions: Collected posts in the process_all_posts format
+        search_query: Product of interest
+        use_llm: Whether uncertain posts are checked with a small model
+        priority: Scheduling class of the small-model calls
+
+    Returns:
+        The filtered submissions and per-query triage counters
+    """
+    stats = {
+        "posts": 0,
+        "kept": 0,
+        "rejected_by_heuristics": 0,
+        "rejected_by_model": 0,
+        "triage_llm_calls": 0,
+    }
+    if search_query not in all_submissions:
+        return all_submissions, stats
+
+    async def keep(data: Dict[str, Any], source: str) -> bool:
+        score = heuristic_score(data, search_query)
+        if score < TRIAGE_REJECT_BELOW:
+            stats["rejected_by_heuristics"] += 1
+            return False
+        if score >= TRIAGE_ACCEPT_ABOVE or not use_llm:
+            return True
+        stats["triage_llm_calls"] += 1
+        try:
+            is_review = await llm_triage(data, search_query, source, priority)
+        except Exception as e:
+            logger.error(f"Triage error for post {data['id']}: {str(e)}")
+            return True
+        if not is_review:
+            stats["rejected_by_model"] += 1
+        return is_review
+
+    triaged = []
+    for submissions in all_submissions[search_query]:
+        filtered = {}
+        for source in ["reddit", "youtube"]:
+            posts = submissions.get(source, [])
+            decisions = await asyncio.gather(
+                *(keep(data, source) for data in posts)
+            )
+            filtered[source] = [
+                data for data, kept in zip(posts, decisions) if kept
+            ]
+            stats["posts"] += len(posts)
+            stats["kept"] += len(filtered[source])
+        triaged.append(filtered)
+
+    for key, value in stats.items():
+        if key != "triage_llm_calls":
+            _stats[key] += value
+    stats["llm_calls_avoided"] = stats["posts"] - stats["kept"]
+    logger.info(f"Triage for '{search_query}': {stats}")
+
+    return {**all_submissions, search_query: triaged}, stats
+
+
+def get_triage_stats() -> Dict[str, int]:
+    return {**_stats, "llm_calls_avoided": _stats["posts"] - _stats["kept"]}
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import extract, func, select, text
+
+from recommender.canonicalize import canonical_query
+from recommender.database import async_session, dedicated_engine
+from recommender.llm_scheduler import SpendBudgetExceeded, spend_meter
+from recommender.models import ProductModel, SearchHistory, StructuredOutput
+from recommender.result_cache import RESULT_CACHE_TTL_SECONDS
+from recommender.single_flight import search_flight
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _parse_hours(value: str) -> Set[int]:
+    """
+    Parse "start-end,start-end" UTC hour ranges into a set of hours. A
+    range whose end comes before its start wraps midnight, e.g. "22-4".
+    """
+    hours = set()
+    for item in value.split(","):
+        if "-" in item:
+            start, end = (int(hour) for hour in item.split("-", 1))
+            if end < start:
+                end += 24
+            hours.update(hour % 24 for hour in range(start, end))
+    return hours
+
+
+# Off by default, the warmer spends LLM budget on queries nobody asked for
+WARMER_ENABLED = os.getenv("WARMER_ENABLED", "false").lower() == "true"
+WARMER_INTERVAL_SECONDS = float(os.getenv("WARMER_INTERVAL_SECONDS", "900"))
+# Hours (UTC) during which the warmer runs, end hour excluded
+WARMER_OFF_PEAK_HOURS = _parse_hours(
+    os.getenv("WARMER_OFF_PEAK_HOURS", "1-6")
+)
+WARMER_MAX_QUERIES = int(os.getenv("WARMER_MAX_QUERIES", "20"))
+# Estimated LLM tokens one run may spend across all of its queries
+WARMER_TOKEN_BUDGET = int(os.getenv("WARMER_TOKEN_BUDGET", "200000"))
+WARMER_HISTORY_DAYS = int(os.getenv("WARMER_HISTORY_DAYS", "14"))
+WARMER_HALF_LIFE_HOURS = float(os.getenv("WARMER_HALF_LIFE_HOURS", "72"))
+# Catalogue products rank like this many recent searches
+WARMER_CATALOGUE_WEIGHT = float(os.getenv("WARMER_CATALOGUE_WEIGHT", "0.5"))
+# Results are refreshed once this share of the cache TTL has passed
+WARMER_REFRESH_AFTER = float(os.getenv("WARMER_REFRESH_AFTER", "0.8"))
+# Advisory lock electing the one process that warms at a time
+WARMER_LOCK_KEY = "recommender-warmer"
+
+
+async def rank_queries(
+    limit: int = WARMER_MAX_QUERIES,
+) -> List[Tuple[str, float]]:
+    """
+    Rank queries worth keeping warm.
+
+    Each search in the recent history counts with a weight halving every
+    WARMER_HALF_LIFE_HOURS, so frequent and recent queries rank first.
+    Product catalogue entries add WARMER_CATALOGUE_WEIGHT.
+
+    Returns:
+        Canonical queries with their scores, best first
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=WARMER_HISTORY_DAYS)
+    age_hours = (
+        extract("epoch", func.now() - SearchHistory.searched_at) / 3600
+    )
+    async with async_session() as db:
+        history = await db.execute(
+            select(
+                SearchHistory.search_query,
+                func.sum(func.power(0.5, age_hours / WARMER_HALF_LIFE_HOURS)),
+            )
+            .filter(SearchHistory.searched_at >= since)
+            .group_by(SearchHistory.search_query)
+        )
+        products = await db.execute(select(ProductModel.product_name))
+
+    scores: Dict[str, float] = {}
+    for query, score in history.all():
+        if query:
+            scores[query] = scores.get(query, 0) + float(score or 0)
+    for (product_name,) in products.all():
+        if product_name:
+            query = await canonical_query(product_name)
+            scores[query] = scores.get(query, 0) + WARMER_CATALOGUE_WEIGHT
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+async def _needs_refresh(queries: List[str]) -> List[str]:
+    """Queries without a stored result or with one close to expiring"""
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=RESULT_CACHE_TTL_SECONDS * WARMER_REFRESH_AFTER
+    )
+    async with async_session() as db:
+        result = await db.execute(
+            select(StructuredOutput.search_query).filter(
+                StructuredOutput.search_query.in_(queries),
+                StructuredOutput.updated_at >= cutoff,
+            )
+        )
+        warm = {query for (query,) in result.all()}
+    return [query for query in queries if query not in warm]
+
+
+class Warmer:
+    """
+    Background task keeping popular queries' results warm.
+
+    During off-peak hours it periodically ranks queries, then refreshes
+    those whose stored result is missing or about to expire, one at a time
+    and at background priority. The LLM calls of one run are metered and
+    the run stops once its token budget is spent. Queries already being
+    computed, for example by a user search, are skipped.
+
+    Every worker process starts a warmer, but only the one holding the
+    warmer advisory lock runs, so the budget applies to the deployment.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float = WARMER_INTERVAL_SECONDS,
+        off_peak_hours: Set[int] = WARMER_OFF_PEAK_HOURS,
+        max_queries: int = WARMER_MAX_QUERIES,
+        token_budget: int = WARMER_TOKEN_BUDGET,
+    ):
+        self.interval_seconds = interval_seconds
+        self.off_peak_hours = off_peak_hours
+        self.max_queries = max_queries
+        self.token_budget = token_budget
+        self._runner: Optional[Callable[[str], Awaitable[Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "runs": 0,
+            "warmed": 0,
+            "failed": 0,
+            "skipped_in_flight": 0,
+            "skipped_not_leader": 0,
+            "budget_exhausted": 0,
+            "tokens_spent": 0,
+        }
+
+    def start(self, runner: Callable[[str], Awaitable[Any]]):
+        """
+        Start the warmer.
+
+        Args:
+            runner: Coroutine function refreshing the stored result of a
+                canonical query
+        """
+        self._runner = runner
+        self._task = asyncio.create_task(self._loop())
+        logger.info(
+            f"Started warmer for off-peak hours {sorted(self.off_peak_hours)}"
+        )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def is_off_peak(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now(timezone.utc)
+        return now.hour in self.off_peak_hours
+
+    async def run_once(self) -> Dict[str, int]:
+        """Warm the top ranked queries within the token budget"""
+        self.stats["runs"] += 1
+        ranked = await rank_queries(self.max_queries)
+        queries = await _needs_refresh([query for query, _ in ranked])
+        logger.info(f"Warming {len(queries)} of {len(ranked)} ranked queries")
+
+        warmed = 0
+        with spend_meter(self.token_budget) as meter:
+            for query in queries:
+                if search_flight.is_in_flight(query):
+                    self.stats["skipped_in_flight"] += 1
+                    continue
+                try:
+                    await self._runner(query)
+                    warmed += 1
+                except SpendBudgetExceeded:
+                    self.stats["budget_exhausted"] += 1
+                    logger.info("Warmer token budget exhausted")
+                    break
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.error(f"Error warming '{query}': {str(e)}")
+        self.stats["warmed"] += warmed
+        self.stats["tokens_spent"] += meter.spent_tokens
+
+        return {"warmed": warmed, "tokens_spent": meter.spent_tokens}
+
+    async def run_as_leader(self) -> Optional[Dict[str, int]]:
+        """
+        Run once if no other process is warming, holding the warmer lock
+        on a dedicated connection for the duration of the run
+        """
+        async with dedicated_engine.begin() as conn:
+            leader = await conn.scalar(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"),
+                {"key": WARMER_LOCK_KEY},
+            )
+            if not leader:
+                self.stats["skipped_not_leader"] += 1
+                return None
+            return await self.run_once()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            if not self.is_off_peak():
+                continue
+            try:
+                await self.run_as_leader()
+            except Exception as e:
+                logger.error(f"Warmer error: {str(e)}", exc_info=True)
+
+
+warmer = Warmer()
@@ -0,0 +1,245 @@
+"""
+SQL statement budgets of the authentication loaders.
+
+The loaders behind the authenticated endpoints are called directly, with
+statements counted by a before_cursor_execute listener on the engine.
+The principal cache tests need no database. The budget tests create
+tables and write users, outputs and reviews to the Postgres database in
+TEST_DATABASE_URL, and are skipped when it is not set.
+
+    TEST_DATABASE_URL=postgresql+asyncpg://... python -m pytest tests
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+from sqlalchemy import event, update  # noqa: E402
+
+from recommender.auth import (  # noqa: E402
+    PrincipalCache,
+    create_access_token,
+    create_user,
+    get_current_user,
+    get_current_user_with_history,
+    get_principal_by_username,
+    principal_cache,
+)
+from recommender.database import async_session, engine, init_db  # noqa: E402
+from recommender.models import (  # noqa: E402
+    Review,
+    SearchHistory,
+    StructuredOutput,
+    User,
+)
+from recommender.schemas import Principal  # noqa: E402
+
+requires_database = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set"
+)
+
+# Searches in the test user's history, each with an output and reviews;
+# loading them per row would exceed the history budget
+HISTORY_ITEMS = 5
+REVIEWS_PER_OUTPUT = 2
+
+# The principal, in one statement
+PRINCIPAL_BUDGET = 1
+# The user, then the history, its outputs and their reviews in one
+# statement each
+HISTORY_BUDGET = 4
+
+
+def principal(user_id: int = 1) -> Principal:
+    return Principal(id=user_id, username=f"user-{user_id}", is_active=True)
+
+
+def test_principal_treats_null_reddit_token_as_false():
+    row = {
+        "id": 1,
+        "username": "user-1",
+        "is_active": True,
+        "has_reddit_refresh_token": None,
+    }
+    assert Principal.model_validate(row).has_reddit_refresh_token is False
+
+
+def test_principal_cache_expires_at_token_exp():
+    cache = PrincipalCache(ttl_seconds=300)
+    cache.set("live", principal(1), exp=time.time() + 60)
+    cache.set("expired", principal(2), exp=time.time() - 1)
+    assert cache.get("live") == principal(1)
+    assert cache.get("expired") is None
+    assert cache.get_stats()["entries"] == 1
+
+
+def test_principal_cache_evicts_least_recently_used():
+    cache = PrincipalCache(max_entries=2)
+    cache.set("first", principal(1), exp=None)
+    cache.set("second", principal(2), exp=None)
+    cache.get("first")
+    cache.set("third", principal(3), exp=None)
+    assert cache.get("second") is None
+    assert cache.get("first") == principal(1)
+    assert cache.get("third") == principal(3)
+
+
+def test_principal_cache_invalidates_every_token_of_a_user():
+    cache = PrincipalCache()
+    cache.set("laptop", principal(1), exp=None)
+    cache.set("phone", principal(1), exp=None)
+    cache.set("other", principal(2), exp=None)
+    cache.invalidate_user(1)
+    assert cache.get("laptop") is None
+    assert cache.get("phone") is None
+    assert cache.get("other") == principal(2)
+
+
+def test_cached_token_skips_decoding_and_the_database():
+    # Not a JWT: decoding it, or touching the missing session, would fail
+    token = f"cached-{uuid.uuid4().hex}"
+    principal_cache.set(token, principal(1), exp=None)
+    try:
+        assert asyncio.run(get_current_user(token, None)) == principal(1)
+    finally:
+        principal_cache.invalidate_user(1)
+
+
+@contextmanager
+def count_statements():
+    statements: List[str] = []
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        statements.append(statement)
+
+    event.listen(
+        engine.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+    try:
+        yield statements
+    finally:
+        event.remove(
+            engine.sync_engine, "before_cursor_execute", before_cursor_execute
+        )
+
+
+async def create_user_with_history() -> str:
+    """Create a user with a search history and return the username"""
+    await init_db()
+    username = f"budget-{uuid.uuid4().hex[:12]}"
+    async with async_session() as db:
+        user = await create_user(
+            db, username, f"{username}@example.com", "password"
+        )
+        for i in range(HISTORY_ITEMS):
+            output = StructuredOutput(
+                search_query=f"{username} {i}",
+                overall_decision="Worth buying",
+            )
+            db.add(output)
+            await db.flush()
+            db.add_all(
+                Review(
+                    structured_output_id=output.id,
+                    source="reddit",
+                    product_name="test product",
+                    post_id=f"{username}-{i}-{j}",
+                    url="https://www.reddit.com/",
+                    review_summary="Battery life is great",
+                    pros=["battery"],
+                    cons=[],
+                    sentiment="positive",
+                    is_product_of_interest=True,
+                    star_rating=4.0,
+                    detail_score=0.5,
+                    balanced_score=0.5,
+                    well_written_score=0.5,
+                )
+                for j in range(REVIEWS_PER_OUTPUT)
+            )
+            db.add(
+                SearchHistory(
+                    user_id=user.id,
+                    search_query=output.search_query,
+                    structured_output_id=output.id,
+                )
+            )
+        await db.commit()
+    return username
+
+
+def run_with_user(check):
+    """Run check(username, token) against a fresh user with a history"""
+
+    async def run():
+        try:
+            username = await create_user_with_history()
+            token = create_access_token(data={"sub": username})
+            return await check(username, token)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+@requires_database
+def test_principal_statement_budget():
+    async def check(username, token):
+        async with async_session() as db:
+            with count_statements() as first:
+                await get_current_user(token, db)
+            with count_statements() as second:
+                await get_current_user(token, db)
+        return first, second
+
+    first, second = run_with_user(check)
+    assert len(first) <= PRINCIPAL_BUDGET, first
+    # Answered from the principal cache once the token is seen
+    assert second == [], second
+
+
+@requires_database
+def test_history_statement_budget():
+    async def check(username, token):
+        async with async_session() as db:
+            with count_statements() as statements:
+                user = await get_current_user_with_history(token, db)
+            # Loaded eagerly, reading it issues no further statements
+            with count_statements() as lazy:
+                reviews = [
+                    review
+                    for item in user.search_history
+                    for review in item.structured_output.reviews
+                ]
+        return statements, lazy, reviews
+
+    statements, lazy, reviews = run_with_user(check)
+    assert len(statements) <= HISTORY_BUDGET, statements
+    assert lazy == [], lazy
+    assert len(reviews) == HISTORY_ITEMS * REVIEWS_PER_OUTPUT
+
+
+@requires_database
+def test_principal_of_user_with_null_reddit_token():
+    async def check(username, token):
+        async with async_session() as db:
+            await db.execute(
+                update(User)
+                .filter(User.username == username)
+                .values(has_reddit_refresh_token=None)
+            )
+            await db.commit()
+            return await get_principal_by_username(db, username)
+
+    assert run_with_user(check).has_reddit_refresh_token is False
@@ -0,0 +1,92 @@
+"""
+Leases and token counting of the Reddit client pool, with stub clients in
+place of asyncpraw so no request reaches Reddit.
+"""
+
+import asyncio
+
+from recommender import reddit_client_pool as pool_module
+from recommender.reddit_client_pool import (
+    ACCESS_TOKEN_PATH,
+    CountingRequestor,
+    RedditClientPool,
+)
+
+
+class StubReddit:
+    def __init__(self, refresh_token):
+        self.refresh_token = refresh_token
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def stub_pool(max_clients: int = 10) -> RedditClientPool:
+    pool = RedditClientPool(max_clients=max_clients)
+    pool._build = StubReddit
+    return pool
+
+
+def test_leased_clients_are_reused():
+    async def run():
+        pool = stub_pool()
+        async with pool.acquire("token") as first:
+            async with pool.acquire("token") as second:
+                assert first is second
+        return pool.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats["built"] == 1
+    assert stats["reused"] == 1
+    assert stats["leased"] == 0
+
+
+def test_evicted_client_closes_when_its_last_lease_ends():
+    async def run():
+        pool = stub_pool(max_clients=1)
+        async with pool.acquire("first") as first:
+            # Evicts the first client while its search still uses it
+            async with pool.acquire("second") as second:
+                assert not first.closed
+            assert not first.closed
+            assert pool.get_stats()["retired"] == 1
+        assert first.closed
+        assert not second.closed
+        await pool.stop()
+        assert second.closed
+        return pool.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats["evicted"] == 2
+    assert stats["retired"] == 0
+
+
+def test_evicting_an_idle_client_closes_it():
+    async def run():
+        pool = stub_pool()
+        async with pool.acquire("token") as reddit:
+            pass
+        await pool.evict("token")
+        return reddit
+
+    assert asyncio.run(run()).closed
+
+
+def test_token_requests_are_counted_when_issued():
+    async def run():
+        requestor = CountingRequestor(user_agent="test-user-agent")
+        before = pool_module._token_refreshes
+        request = requestor.request(
+            "POST", f"https://www.reddit.com{ACCESS_TOKEN_PATH}"
+        )
+        counted = pool_module._token_refreshes - before
+        requestor.request("GET", "https://oauth.reddit.com/api/v1/me")
+        # Neither request is sent: asyncprawcore 2 returns a coroutine,
+        # asyncprawcore 4 a context manager, both left unstarted
+        if asyncio.iscoroutine(request):
+            request.close()
+        await requestor.close()
+        return counted, pool_module._token_refreshes - before
+
+    assert asyncio.run(run()) == (1, 1)
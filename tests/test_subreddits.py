@@ -0,0 +1,43 @@
+"""
+Subreddits searched for a query, from the catalogue category of its
+product. The category lookup is replaced so no database is needed.
+"""
+
+import asyncio
+
+import pytest
+
+from recommender import collect_data
+from recommender.collect_data import DEFAULT_SUBREDDITS, subreddits_for_query
+
+
+def subreddits_for_category(monkeypatch, category):
+    async def product_category(query):
+        return category
+
+    monkeypatch.setattr(collect_data, "product_category", product_category)
+    return asyncio.run(subreddits_for_query("a product"))
+
+
+def test_headphones_are_not_phones(monkeypatch):
+    subreddits = subreddits_for_category(monkeypatch, "Headphones")
+    assert "headphones" in subreddits
+    assert "smartphones" not in subreddits
+
+
+@pytest.mark.parametrize(
+    "category,subreddit",
+    [
+        ("Smartphones", "smartphones"),
+        ("Phones", "smartphones"),
+        ("Smartwatches", "smartwatch"),
+        ("Laptops", "laptops"),
+        ("TVs", "4kTV"),
+    ],
+)
+def test_category_maps_to_subreddits(monkeypatch, category, subreddit):
+    assert subreddit in subreddits_for_category(monkeypatch, category)
+
+
+def test_unknown_category_searches_defaults(monkeypatch):
+    assert subreddits_for_category(monkeypatch, None) == DEFAULT_SUBREDDITS